@@ -48,6 +48,19 @@ export function useWebSocket() {
             });
             updateDeviceData(dataDeviceId, message.sensor, message.value);
             break;
+
+          case "data_batch":
+            for (const sample of message.samples ?? []) {
+              const sampleDeviceId = sample.deviceId || "dev-1";
+              addSensorDataPoint(sampleDeviceId, {
+                sensor: sample.sensor,
+                value: sample.value,
+                timestamp: sample.timestamp,
+                unit: sample.unit,
+              });
+              updateDeviceData(sampleDeviceId, sample.sensor, sample.value);
+            }
+            break;
             
           case "variable_update":
             const updateDeviceId = message.deviceId || "dev-1";
@@ -265,6 +265,12 @@ class PythonBackendClient {
 
           if (message.type === "data") {
             this.emitData(message.payload);
+          } else if (message.type === "data_batch") {
+            for (const sample of message.samples ?? []) {
+              if (sample.payload !== undefined) {
+                this.emitData(sample.payload);
+              }
+            }
           } else if (message.type === "status") {
             this.currentStatus = message.payload;
             this.emitStatus(this.currentStatus);
@@ -4,19 +4,32 @@ Handles custom user tables, AI training data, and database operations
 """
 
 import json
+import os
+import random
+import time
 import uuid
+import zlib
+from collections import defaultdict, deque
 from datetime import datetime
 from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, HTTPException, Response
+import orjson
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
 
+# Dedicated generator for mock training/prediction values, kept apart from
+# the shared module-level random state
+_rng = random.Random()
+
+# Prediction history kept per model; older records are dropped on append
+MAX_PREDICTIONS_PER_MODEL = 10_000
+
 # Mock storage for demonstration - in production, use actual database
 mock_database = {
     "custom_tables": [],
     "ai_models": [],
     "training_sessions": [],
     "table_data": {},  # Store actual table data: {table_id: [rows]}
-    "predictions": [],
+    "predictions": defaultdict(lambda: deque(maxlen=MAX_PREDICTIONS_PER_MODEL)),  # {model_id: recent predictions}
     "anomalies": [],
     "database_stats": {
         "total_tables": 0,
@@ -30,6 +43,39 @@ mock_database = {
     }
 }
 
+# Polling dashboards hit /stats repeatedly; reuse the payload for this long
+STATS_CACHE_TTL = 1.0
+
+# Quality scoring scans every row of a table, so write-heavy workloads only
+# rescore dirty tables at most this often
+QUALITY_REFRESH_INTERVAL = 5.0
+
+# Serialized GET payloads, reused until the collection's version is bumped
+_cache_version = {"tables": 0, "ai_models": 0, "training_sessions": 0}
+_response_cache: Dict[str, tuple] = {}  # {collection: (version, json bytes)}
+
+# Incremental stats cache: per-table contributions are only recomputed
+# for tables touched since the last refresh
+_stats_cache: Dict[str, Any] = {
+    "total_rows": 0,
+    "total_size": 0,
+    "data_quality_score": 0.0,
+    "table_stats": {},  # {table_id: (rows, size_bytes)}
+    "table_scores": {},  # {table_id: quality score}, tables with rows only
+    "score_sum": 0.0,
+    "dirty_tables": set(),
+    "quality_dirty_tables": set(),
+    "quality_computed_at": 0.0,
+    "stats": None,  # Last DatabaseStats payload
+    "stats_json": b"",
+    "stats_etag": "",
+    "computed_at": 0.0
+}
+
+# Versions restart at 0 with an empty database, so ETags also carry a
+# per-process token; a client's copy from before a restart never matches
+_ETAG_TOKEN = f"{os.getpid():x}{time.time_ns():x}"
+
 router = APIRouter(prefix="/api/database", tags=["database"])
 
 # ============== Pydantic Models ==============
@@ -106,36 +152,136 @@ class DatabaseStats(BaseModel):
     anomalies_detected: int
     data_quality_score: float
 
+# Fields a PATCH may change; id, timestamps and row/size counters are managed here
+MUTABLE_TABLE_FIELDS = frozenset({
+    "project_id", "table_name", "table_type", "description", "schema_definition",
+    "is_public", "ai_trainable", "retention_days"
+})
+
+# Stored records may carry extra keys (e.g. table_id); GET responses expose
+# only the declared fields
+AI_MODEL_FIELDS = tuple(AIModel.model_fields)
+TRAINING_SESSION_FIELDS = tuple(TrainingSession.model_fields)
+
 # ============== Helper Functions ==============
 
-def calculate_data_quality_score():
-    """Calculate overall data quality score"""
-    if not mock_database["custom_tables"]:
-        return 0.0
+def project_fields(record: Dict[str, Any], fields: tuple) -> Dict[str, Any]:
+    """Pick response fields from a stored record without re-validating it"""
+    return {key: record.get(key) for key in fields}
+
+def calculate_table_quality_score(table_id: str) -> Optional[float]:
+    """Calculate data quality score for a single table (None if it has no rows)"""
+    table_data = mock_database["table_data"].get(table_id, [])
+    if not table_data:
+        return None
     
-    total_score = 0.0
-    table_count = 0
+    # Simple quality metrics
+    completeness = sum(1 for row in table_data if all(v is not None for v in row.values())) / len(table_data)
+    consistency = 1.0  # Simplified - in real implementation, check data consistency
+    accuracy = 0.95  # Simplified - in real implementation, validate against rules
     
-    for table in mock_database["custom_tables"]:
-        table_id = table["id"]
-        table_data = mock_database["table_data"].get(table_id, [])
+    return completeness * 0.4 + consistency * 0.3 + accuracy * 0.3
+
+def bump_cache_version(collection: str):
+    """Invalidate cached GET payloads for a collection after a mutation"""
+    _cache_version[collection] += 1
+
+def json_response(request: Request, body: bytes, etag: str) -> Response:
+    """Return pre-serialized JSON, short-circuiting with 304 on a matching ETag"""
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+def encode_json(obj: Any) -> bytes:
+    """Encode with orjson, falling back to the stdlib for integers wider than 64 bits"""
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        return json.dumps(obj, default=str).encode()
+
+def cached_collection_response(request: Request, collection: str, build) -> Response:
+    """Serve a collection from its cached JSON bytes, rebuilding on version change"""
+    version = _cache_version[collection]
+    cached = _response_cache.get(collection)
+    if cached is None or cached[0] != version:
+        cached = (version, encode_json(build()))
+        _response_cache[collection] = cached
+    return json_response(request, cached[1], f'W/"{collection}-{_ETAG_TOKEN}-v{version}"')
+
+def mark_table_dirty(table_id: str):
+    """Flag a table so its stats contribution is recomputed on next refresh"""
+    bump_cache_version("tables")
+    cache = _stats_cache
+    cache["dirty_tables"].add(table_id)
+    cache["quality_dirty_tables"].add(table_id)
+    cache["stats"] = None
+
+def refresh_stats_cache(refresh_quality: bool = True) -> Dict[str, Any]:
+    """Recompute stats contributions of dirty tables only
+    
+    Row and size totals are always brought up to date; quality scores of
+    dirty tables are only recomputed when refresh_quality is set.
+    """
+    cache = _stats_cache
+    dirty = cache["dirty_tables"]
+    quality_dirty = cache["quality_dirty_tables"] if refresh_quality else set()
+    if not dirty and not quality_dirty:
+        return cache
+    
+    tables = {
+        t["id"]: t for t in mock_database["custom_tables"]
+        if t["id"] in dirty or t["id"] in quality_dirty
+    }
+    
+    table_stats = cache["table_stats"]
+    for table_id in dirty:
+        previous = table_stats.pop(table_id, None)
+        if previous:
+            cache["total_rows"] -= previous[0]
+            cache["total_size"] -= previous[1]
         
-        if not table_data:
+        table = tables.get(table_id)
+        if not table:
             continue
-            
-        # Simple quality metrics
-        completeness = sum(1 for row in table_data if all(v is not None for v in row.values())) / len(table_data)
-        consistency = 1.0  # Simplified - in real implementation, check data consistency
-        accuracy = 0.95  # Simplified - in real implementation, validate against rules
         
-        table_score = (completeness * 0.4 + consistency * 0.3 + accuracy * 0.3)
-        total_score += table_score
-        table_count += 1
+        rows = table.get("row_count", 0)
+        size = table.get("size_bytes", 0)
+        table_stats[table_id] = (rows, size)
+        cache["total_rows"] += rows
+        cache["total_size"] += size
+    dirty.clear()
+    
+    if refresh_quality:
+        table_scores = cache["table_scores"]
+        for table_id in quality_dirty:
+            cache["score_sum"] -= table_scores.pop(table_id, 0.0)
+            score = calculate_table_quality_score(table_id) if table_id in tables else None
+            if score is not None:
+                table_scores[table_id] = score
+                cache["score_sum"] += score
+        quality_dirty.clear()
+        
+        cache["data_quality_score"] = (
+            cache["score_sum"] / len(table_scores) if table_scores else 0.0
+        )
+        cache["quality_computed_at"] = time.monotonic()
     
-    return total_score / table_count if table_count > 0 else 0.0
+    return cache
+
+def estimate_row_size(row: Dict[str, Any]) -> int:
+    """Estimate the stored size of a row as its encoded JSON length"""
+    try:
+        return len(orjson.dumps(row, default=str))
+    except TypeError:
+        # orjson rejects integers wider than 64 bits
+        return len(str(row).encode())
 
-def update_table_stats(table_id: str):
-    """Update table statistics after data changes"""
+def update_table_stats(table_id: str, size_delta: Optional[int] = None):
+    """Update table statistics after data changes
+    
+    Pass size_delta when the byte change is known to avoid re-encoding the
+    whole table; otherwise size_bytes is recomputed from every row.
+    """
     table = next((t for t in mock_database["custom_tables"] if t["id"] == table_id), None)
     if not table:
         return
@@ -144,39 +290,53 @@ def update_table_stats(table_id: str):
     table["row_count"] = len(table_data)
     
     # Estimate size (simplified calculation)
-    estimated_size = len(str(table_data).encode('utf-8'))
-    table["size_bytes"] = estimated_size
+    if size_delta is None:
+        table["size_bytes"] = sum(estimate_row_size(row) for row in table_data)
+    else:
+        table["size_bytes"] = max(0, table.get("size_bytes", 0) + size_delta)
     table["updated_at"] = datetime.now().isoformat()
     
-    # Update global stats
-    mock_database["database_stats"]["data_quality_score"] = calculate_data_quality_score()
+    # Global stats are refreshed lazily by get_database_stats
+    mark_table_dirty(table_id)
 
 # ============== Database Statistics ==============
 
 @router.get("/stats", response_model=DatabaseStats)
-async def get_database_stats():
+async def get_database_stats(request: Request):
     """Get overall database statistics and metrics"""
+    cache = _stats_cache
+    now = time.monotonic()
+    if cache["stats"] is not None and now - cache["computed_at"] < STATS_CACHE_TTL:
+        return json_response(request, cache["stats_json"], cache["stats_etag"])
+    
     # Update stats based on current data
+    refresh_stats_cache(
+        refresh_quality=now - cache["quality_computed_at"] >= QUALITY_REFRESH_INTERVAL
+    )
     stats = mock_database["database_stats"].copy()
     stats["total_tables"] = len(mock_database["custom_tables"])
     stats["ai_models"] = len(mock_database["ai_models"])
     stats["training_sessions"] = len(mock_database["training_sessions"])
+    stats["total_rows"] = cache["total_rows"]
+    stats["total_size_mb"] = cache["total_size"] / (1024 * 1024)
+    stats["data_quality_score"] = cache["data_quality_score"]
     
-    # Calculate total rows and size from tables
-    total_rows = sum(table.get("row_count", 0) for table in mock_database["custom_tables"])
-    total_size = sum(table.get("size_bytes", 0) for table in mock_database["custom_tables"])
-    
-    stats["total_rows"] = total_rows
-    stats["total_size_mb"] = total_size / (1024 * 1024)
-    
-    return DatabaseStats(**stats)
+    body = orjson.dumps(stats)
+    cache["stats"] = stats
+    cache["stats_json"] = body
+    cache["stats_etag"] = f'W/"stats-{zlib.crc32(body):08x}"'
+    cache["computed_at"] = now
+    return json_response(request, body, cache["stats_etag"])
 
 # ============== Custom Tables Management ==============
 
 @router.get("/tables", response_model=List[CustomTable])
-async def get_custom_tables():
+async def get_custom_tables(request: Request):
     """Get all custom tables for the user"""
-    return [CustomTable(**table) for table in mock_database["custom_tables"]]
+    return cached_collection_response(
+        request, "tables",
+        lambda: mock_database["custom_tables"]
+    )
 
 @router.post("/tables", response_model=CustomTable, status_code=201)
 async def create_custom_table(data: CreateCustomTable):
@@ -210,7 +370,8 @@ async def create_custom_table(data: CreateCustomTable):
     
     mock_database["custom_tables"].append(new_table)
     mock_database["table_data"][table_id] = []  # Initialize empty data
-    return CustomTable(**new_table)
+    mark_table_dirty(table_id)
+    return new_table
 
 @router.get("/tables/{table_id}", response_model=CustomTable)
 async def get_custom_table(table_id: str):
@@ -218,7 +379,7 @@ async def get_custom_table(table_id: str):
     table = next((t for t in mock_database["custom_tables"] if t["id"] == table_id), None)
     if not table:
         raise HTTPException(404, "Table not found")
-    return CustomTable(**table)
+    return table
 
 @router.patch("/tables/{table_id}", response_model=CustomTable)
 async def update_custom_table(table_id: str, updates: Dict[str, Any]):
@@ -227,13 +388,17 @@ async def update_custom_table(table_id: str, updates: Dict[str, Any]):
     if not table:
         raise HTTPException(404, "Table not found")
     
-    # Update fields
+    # Update fields; idempotent PATCHes leave updated_at and caches untouched
+    changed = False
     for key, value in updates.items():
-        if key in table:
+        if key in MUTABLE_TABLE_FIELDS and table.get(key) != value:
             table[key] = value
+            changed = True
     
-    table["updated_at"] = datetime.now().isoformat()
-    return CustomTable(**table)
+    if changed:
+        table["updated_at"] = datetime.now().isoformat()
+        bump_cache_version("tables")
+    return table
 
 @router.delete("/tables/{table_id}", status_code=204)
 async def delete_custom_table(table_id: str):
@@ -246,6 +411,7 @@ async def delete_custom_table(table_id: str):
     # Also delete the table data
     if table_id in mock_database["table_data"]:
         del mock_database["table_data"][table_id]
+    mark_table_dirty(table_id)
     return Response(status_code=204)
 
 # ============== Table Data Management ==============
@@ -289,8 +455,9 @@ async def add_table_data(table_id: str, data: Dict[str, Any]):
     if "id" not in row_data:
         row_data["id"] = str(uuid.uuid4())
     
+    row_size = estimate_row_size(row_data)
     mock_database["table_data"][table_id].append(row_data)
-    update_table_stats(table_id)
+    update_table_stats(table_id, row_size)
     
     return {
         "success": True,
@@ -316,8 +483,9 @@ async def update_table_row(table_id: str, row_id: str, data: Dict[str, Any]):
     updated_data["id"] = row_id  # Preserve ID
     updated_data["updated_at"] = datetime.now().isoformat()
     
+    size_delta = estimate_row_size(updated_data) - estimate_row_size(table_data[row_index])
     mock_database["table_data"][table_id][row_index] = updated_data
-    update_table_stats(table_id)
+    update_table_stats(table_id, size_delta)
     
     return {
         "success": True,
@@ -337,8 +505,8 @@ async def delete_table_row(table_id: str, row_id: str):
     if row_index is None:
         raise HTTPException(404, "Row not found")
     
-    mock_database["table_data"][table_id].pop(row_index)
-    update_table_stats(table_id)
+    removed_row = mock_database["table_data"][table_id].pop(row_index)
+    update_table_stats(table_id, -estimate_row_size(removed_row))
     
     return {
         "success": True,
@@ -348,9 +516,12 @@ async def delete_table_row(table_id: str, row_id: str):
 # ============== AI Models Management ==============
 
 @router.get("/ai-models", response_model=List[AIModel])
-async def get_ai_models():
+async def get_ai_models(request: Request):
     """Get all AI models for the user"""
-    return [AIModel(**model) for model in mock_database["ai_models"]]
+    return cached_collection_response(
+        request, "ai_models",
+        lambda: [project_fields(model, AI_MODEL_FIELDS) for model in mock_database["ai_models"]]
+    )
 
 @router.post("/ai-models", response_model=AIModel, status_code=201)
 async def create_ai_model(data: Dict[str, Any]):
@@ -370,14 +541,18 @@ async def create_ai_model(data: Dict[str, Any]):
     }
     
     mock_database["ai_models"].append(new_model)
-    return AIModel(**new_model)
+    bump_cache_version("ai_models")
+    return new_model
 
 # ============== Training Sessions Management ==============
 
 @router.get("/training-sessions", response_model=List[TrainingSession])
-async def get_training_sessions():
+async def get_training_sessions(request: Request):
     """Get all training sessions for the user"""
-    return [TrainingSession(**session) for session in mock_database["training_sessions"]]
+    return cached_collection_response(
+        request, "training_sessions",
+        lambda: [project_fields(session, TRAINING_SESSION_FIELDS) for session in mock_database["training_sessions"]]
+    )
 
 @router.post("/training-sessions", response_model=TrainingSession, status_code=201)
 async def create_training_session(data: Dict[str, Any]):
@@ -398,7 +573,8 @@ async def create_training_session(data: Dict[str, Any]):
     }
     
     mock_database["training_sessions"].append(new_session)
-    return TrainingSession(**new_session)
+    bump_cache_version("training_sessions")
+    return new_session
 
 # ============== Data Import/Export ==============
 
@@ -409,25 +585,24 @@ async def import_data(data: ImportData):
     if not table:
         raise HTTPException(404, "Table not found")
     
-    if data.table_id not in mock_database["table_data"]:
+    if data.table_id not in mock_database["table_data"] or data.import_mode == "replace":
         mock_database["table_data"][data.table_id] = []
     
-    imported_rows = 0
-    
+    # Add metadata to each row
+    now = datetime.now().isoformat()
     for row in data.data:
-        # Add metadata to each row
         if "id" not in row:
             row["id"] = str(uuid.uuid4())
         if "imported_at" not in row:
-            row["imported_at"] = datetime.now().isoformat()
-        
-        if data.import_mode == "replace":
-            mock_database["table_data"][data.table_id] = []
-        
-        mock_database["table_data"][data.table_id].append(row)
-        imported_rows += 1
+            row["imported_at"] = now
+    
+    mock_database["table_data"][data.table_id].extend(data.data)
+    imported_rows = len(data.data)
     
-    update_table_stats(data.table_id)
+    if data.import_mode == "replace":
+        update_table_stats(data.table_id)
+    else:
+        update_table_stats(data.table_id, sum(estimate_row_size(row) for row in data.data))
     
     return {
         "success": True,
@@ -480,31 +655,42 @@ async def get_table_analytics(table_id: str):
             }
         }
     
-    # Analyze data structure
-    all_columns = set()
-    for row in table_data:
-        all_columns.update(row.keys())
+    # Analyze data structure in a single pass over the rows, touching each
+    # cell once instead of re-scanning the table for every column
+    non_null_counts: Dict[str, int] = {}
+    unique_values: Dict[str, set] = {}
+    sample_values: Dict[str, Any] = {}
     
+    for row in table_data:
+        for column, value in row.items():
+            if column not in non_null_counts:
+                non_null_counts[column] = 0
+                unique_values[column] = set()
+            if value is None:
+                continue
+            non_null_counts[column] += 1
+            unique_values[column].add(str(value))
+            if column not in sample_values:
+                sample_values[column] = value
+    
+    row_count = len(table_data)
     analytics = {
-        "row_count": len(table_data),
-        "columns": list(all_columns),
+        "row_count": row_count,
+        "columns": list(non_null_counts),
         "data_types": {},
         "null_counts": {},
         "unique_counts": {},
         "sample_data": table_data[:5]  # First 5 rows as sample
     }
     
-    # Analyze each column
-    for column in all_columns:
-        values = [row.get(column) for row in table_data]
-        non_null_values = [v for v in values if v is not None]
+    # Summarize each column
+    for column, non_null_count in non_null_counts.items():
+        analytics["null_counts"][column] = row_count - non_null_count
+        analytics["unique_counts"][column] = len(unique_values[column])
         
-        analytics["null_counts"][column] = len(values) - len(non_null_values)
-        analytics["unique_counts"][column] = len(set(str(v) for v in non_null_values))
-        
-        # Determine data type
-        if non_null_values:
-            sample_value = non_null_values[0]
+        # Determine data type from the first non-null value
+        if column in sample_values:
+            sample_value = sample_values[column]
             if isinstance(sample_value, bool):
                 analytics["data_types"][column] = "boolean"
             elif isinstance(sample_value, int):
@@ -558,9 +744,8 @@ async def train_model(data: StartTraining):
     mock_database["training_sessions"].append(training_session)
     
     # Simulate training completion after a short delay
-    import random
-    training_duration = random.randint(30, 300)  # 30 seconds to 5 minutes
-    accuracy = random.uniform(0.75, 0.98)  # Random accuracy between 75-98%
+    training_duration = _rng.randint(30, 300)  # 30 seconds to 5 minutes
+    accuracy = _rng.uniform(0.75, 0.98)  # Random accuracy between 75-98%
     
     # Update session to completed
     training_session["status"] = "completed"
@@ -591,6 +776,8 @@ async def train_model(data: StartTraining):
     }
     
     mock_database["ai_models"].append(new_model)
+    bump_cache_version("ai_models")
+    bump_cache_version("training_sessions")
     
     return {
         "success": True,
@@ -610,6 +797,7 @@ async def deploy_model(model_id: str):
     
     model["deployment_status"] = "deployed"
     model["deployment_endpoint"] = f"/api/models/{model_id}/predict"
+    bump_cache_version("ai_models")
     
     return {
         "success": True,
@@ -628,29 +816,27 @@ async def make_prediction(model_id: str, input_data: Dict[str, Any]):
         raise HTTPException(400, "Model is not deployed")
     
     # Mock prediction
-    import random
-    
     prediction_id = str(uuid.uuid4())
-    confidence = random.uniform(0.6, 0.95)
+    confidence = _rng.uniform(0.6, 0.95)
     
     if model["model_type"] == "anomaly_detection":
         prediction_result = {
-            "is_anomaly": random.choice([True, False]),
-            "anomaly_score": random.uniform(0.0, 1.0),
+            "is_anomaly": _rng.choice([True, False]),
+            "anomaly_score": _rng.uniform(0.0, 1.0),
             "confidence": confidence
         }
     elif model["model_type"] == "classification":
         classes = ["normal", "warning", "critical"]
         prediction_result = {
-            "predicted_class": random.choice(classes),
+            "predicted_class": _rng.choice(classes),
             "confidence": confidence,
-            "probabilities": {cls: random.uniform(0.1, 0.9) for cls in classes}
+            "probabilities": {cls: _rng.uniform(0.1, 0.9) for cls in classes}
         }
     else:  # prediction/regression
         prediction_result = {
-            "predicted_value": random.uniform(10.0, 100.0),
+            "predicted_value": _rng.uniform(10.0, 100.0),
             "confidence": confidence,
-            "prediction_interval": [random.uniform(5.0, 15.0), random.uniform(95.0, 105.0)]
+            "prediction_interval": [_rng.uniform(5.0, 15.0), _rng.uniform(95.0, 105.0)]
         }
     
     # Store prediction
@@ -663,11 +849,12 @@ async def make_prediction(model_id: str, input_data: Dict[str, Any]):
         "timestamp": datetime.now().isoformat()
     }
     
-    mock_database["predictions"].append(prediction_record)
+    mock_database["predictions"][model_id].append(prediction_record)
     
     # Update model usage count
     model["usage_count"] += 1
     model["last_used_at"] = datetime.now().isoformat()
+    bump_cache_version("ai_models")
     
     return {
         "prediction_id": prediction_id,
@@ -685,15 +872,17 @@ async def get_model_predictions(model_id: str, limit: int = 100):
     if not model:
         raise HTTPException(404, "Model not found")
     
-    # Mock predictions data
-    predictions = []
-    for i in range(min(limit, 10)):  # Mock up to 10 predictions
-        predictions.append({
+    # Mock predictions data (up to 10 predictions)
+    now = datetime.now().isoformat()
+    predictions = [
+        {
             "id": str(uuid.uuid4()),
             "input_data": {"feature_1": i * 0.1, "feature_2": i * 0.2},
             "prediction": {"class": "normal", "confidence": 0.85 + i * 0.01},
-            "timestamp": datetime.now().isoformat()
-        })
+            "timestamp": now
+        }
+        for i in range(min(limit, 10))
+    ]
     
     return {
         "model_id": model_id,
@@ -3,14 +3,18 @@ ESP32 Device Communicator Module for µCodeLab v2.0
 Handles Serial, WiFi, WebSocket, and MQTT communication with ESP32/Arduino devices
 """
 
+import asyncio
 import logging
-import json
+import socket
 import time
 import threading
+import uuid
 from enum import Enum
-from typing import Optional, Dict, Any, Callable, List
+from typing import Optional, Dict, Any, Callable, List, Union
 from dataclasses import dataclass, field
-from queue import Queue
+from collections import deque
+
+import orjson
 
 try:
     import serial
@@ -27,6 +31,15 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Serial read timeout (seconds); bounds how long the reader thread takes to stop
+SERIAL_READ_TIMEOUT = 0.1
+
+# Longest partial line buffered while waiting for its newline
+SERIAL_MAX_LINE = 4096
+
+# How long a serial port scan stays fresh (seconds)
+SERIAL_PORTS_CACHE_TTL = 2.0
+
 
 class ConnectionType(Enum):
     """Supported connection types"""
@@ -36,7 +49,7 @@ class ConnectionType(Enum):
     MQTT = "mqtt"
 
 
-@dataclass
+@dataclass(slots=True)
 class CommandResult:
     """Result of a command execution"""
     success: bool
@@ -44,7 +57,7 @@ class CommandResult:
     data: Optional[Dict[str, Any]] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class SensorData:
     """Sensor data from device"""
     temperature: Optional[float] = None
@@ -75,9 +88,17 @@ class DeviceManager:
         self._mqtt_client: Optional[Any] = None
         self._data_callback: Optional[Callable[[Dict], None]] = None
         self._sensor_data: Optional[SensorData] = None
-        self._raw_queue: Queue = Queue(maxsize=100)
+        # Lines are handed from the reader thread via GIL-atomic deque ops;
+        # once full, the oldest line is dropped
+        self._raw_queue: deque = deque(maxlen=100)
         self._read_thread: Optional[threading.Thread] = None
+        # Serializes port writes from worker threads so whole frames never interleave
+        self._write_lock = threading.Lock()
         self._running: bool = False
+        self._status_cache: Dict[str, Any] = {}
+        self._invalidate_status()
+        self._ports_cache: Optional[List[Dict[str, str]]] = None
+        self._ports_cache_ts: float = 0.0
     
     def configure(
         self,
@@ -101,6 +122,7 @@ class DeviceManager:
         self._mqtt_broker = mqtt_broker
         self._mqtt_port = mqtt_port
         self._mqtt_topic_prefix = mqtt_topic_prefix
+        self._invalidate_status()
     
     def connect(self, conn_type: Optional[ConnectionType] = None) -> bool:
         """Connect to device using specified or configured connection type"""
@@ -111,6 +133,13 @@ class DeviceManager:
             logger.error("No connection type configured")
             return False
         
+        try:
+            return self._connect()
+        finally:
+            self._invalidate_status()
+    
+    def _connect(self) -> bool:
+        """Dispatch to the transport-specific connect method"""
         try:
             if self._connection_type == ConnectionType.SERIAL:
                 return self._connect_serial()
@@ -141,7 +170,7 @@ class DeviceManager:
             self._serial = serial.Serial(
                 port=self._port,
                 baudrate=self._baud_rate,
-                timeout=1
+                timeout=SERIAL_READ_TIMEOUT
             )
             self._connected = True
             self._running = True
@@ -167,10 +196,17 @@ class DeviceManager:
             return False
         
         try:
-            self._mqtt_client = mqtt.Client()
+            self._mqtt_client = mqtt.Client(client_id=f"ucodelab-{uuid.uuid4().hex[:8]}")
             self._mqtt_client.on_connect = self._on_mqtt_connect
             self._mqtt_client.on_message = self._on_mqtt_message
+            self._mqtt_client.max_inflight_messages_set(100)
             self._mqtt_client.connect(self._mqtt_broker, self._mqtt_port, 60)
+            
+            # Commands are tiny and latency-sensitive; don't let Nagle hold them back
+            mqtt_socket = self._mqtt_client.socket()
+            if mqtt_socket:
+                mqtt_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            
             self._mqtt_client.loop_start()
             self._connected = True
             logger.info(f"MQTT connected to {self._mqtt_broker}:{self._mqtt_port}")
@@ -194,30 +230,60 @@ class DeviceManager:
     
     def _on_mqtt_message(self, client, userdata, msg):
         """MQTT on_message callback"""
+        # The wildcard subscription also delivers our own published commands;
+        # drop them here instead of bouncing them back into the event loop
+        if msg.topic == f"{self._mqtt_topic_prefix}/command":
+            return
+        
         try:
-            payload = json.loads(msg.payload.decode())
+            payload = orjson.loads(msg.payload)
             if self._data_callback:
                 self._data_callback(payload)
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logger.warning(f"Invalid JSON from MQTT: {msg.payload}")
     
     def _serial_read_loop(self):
         """Background thread for reading serial data"""
+        # read() blocks until bytes arrive or the port timeout expires, so the
+        # thread wakes on data instead of polling; bursts are drained in one
+        # call and partial lines stay buffered until their newline arrives
+        buffer = bytearray()
         while self._running and self._serial and self._serial.is_open:
             try:
-                if self._serial.in_waiting:
-                    line = self._serial.readline().decode('utf-8', errors='ignore').strip()
+                chunk = self._serial.read(self._serial.in_waiting or 1)
+                if not chunk:
+                    continue
+                buffer.extend(chunk)
+                
+                newline = buffer.find(b"\n")
+                while newline != -1:
+                    line = buffer[:newline].decode('utf-8', errors='ignore').strip()
+                    del buffer[:newline + 1]
+                    if line:
+                        self._process_serial_data(line)
+                    newline = buffer.find(b"\n")
+                
+                # No newline in sight (wrong baud rate, binary output): pass
+                # the bytes on as a line rather than buffering without bound
+                if len(buffer) > SERIAL_MAX_LINE:
+                    line = buffer.decode('utf-8', errors='ignore').strip()
+                    buffer.clear()
                     if line:
                         self._process_serial_data(line)
             except Exception as e:
                 logger.error(f"Serial read error: {e}")
-            time.sleep(0.01)
+                time.sleep(SERIAL_READ_TIMEOUT)
     
     def _process_serial_data(self, data: str):
         """Process incoming serial data"""
+        # Most non-JSON lines are plain log prints; don't pay for a failed parse
+        if not data.lstrip().startswith("{"):
+            self._raw_queue.append(data)
+            return
+        
         try:
             # Try to parse as JSON
-            parsed = json.loads(data)
+            parsed = orjson.loads(data)
             
             # Update sensor data if applicable
             self._sensor_data = SensorData(
@@ -233,16 +299,22 @@ class DeviceManager:
             if self._data_callback:
                 self._data_callback(parsed)
                 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # Store as raw data
-            if not self._raw_queue.full():
-                self._raw_queue.put(data)
+            self._raw_queue.append(data)
     
     def disconnect(self):
         """Disconnect from device"""
         self._running = False
         self._connected = False
         
+        # Let the reader notice _running within one read timeout before the port
+        # closes under it; otherwise a quick reconnect can leave two readers
+        # competing for the same port (and the GIL)
+        if self._read_thread and self._read_thread is not threading.current_thread():
+            self._read_thread.join(timeout=SERIAL_READ_TIMEOUT * 10)
+        self._read_thread = None
+        
         if self._serial and self._serial.is_open:
             self._serial.close()
             self._serial = None
@@ -252,6 +324,7 @@ class DeviceManager:
             self._mqtt_client.disconnect()
             self._mqtt_client = None
         
+        self._invalidate_status()
         logger.info("Disconnected from device")
     
     def send_command(self, command: str, value: Any = None) -> CommandResult:
@@ -282,8 +355,8 @@ class DeviceManager:
         if not self._serial or not self._serial.is_open:
             return CommandResult(success=False, message="Serial not connected")
         
-        data = json.dumps(payload) + "\n"
-        self._serial.write(data.encode())
+        with self._write_lock:
+            self._serial.write(orjson.dumps(payload) + b"\n")
         return CommandResult(success=True, message="Command sent")
     
     def _send_http(self, payload: Dict) -> CommandResult:
@@ -297,33 +370,51 @@ class DeviceManager:
             return CommandResult(success=False, message="MQTT not connected")
         
         topic = f"{self._mqtt_topic_prefix}/command"
-        self._mqtt_client.publish(topic, json.dumps(payload))
+        self._mqtt_client.publish(topic, orjson.dumps(payload), qos=0, retain=False)
         return CommandResult(success=True, message="MQTT command published")
     
-    def send_raw(self, data: str) -> CommandResult:
+    def send_raw(self, data: Union[str, bytes]) -> CommandResult:
         """Send raw data to device"""
         if not self._connected:
             return CommandResult(success=False, message="Not connected")
         
         if self._connection_type == ConnectionType.SERIAL and self._serial:
-            self._serial.write((data + "\n").encode())
+            if isinstance(data, str):
+                data = data.encode()
+            with self._write_lock:
+                self._serial.write(data + b"\n")
             return CommandResult(success=True, message="Raw data sent")
         
         return CommandResult(success=False, message="Raw send not supported for this connection type")
     
+    async def send_command_async(self, command: str, value: Any = None) -> CommandResult:
+        """Send command to device without blocking the event loop"""
+        # Serial writes block until the bytes are out; the other transports
+        # only hand off to a background thread or are simulated
+        if self._connection_type == ConnectionType.SERIAL:
+            return await asyncio.to_thread(self.send_command, command, value)
+        return self.send_command(command, value)
+    
+    async def send_raw_async(self, data: Union[str, bytes]) -> CommandResult:
+        """Send raw data to device without blocking the event loop"""
+        if self._connection_type == ConnectionType.SERIAL:
+            return await asyncio.to_thread(self.send_raw, data)
+        return self.send_raw(data)
+    
     def read_raw(self) -> Optional[str]:
         """Read raw data from queue"""
-        if not self._raw_queue.empty():
-            return self._raw_queue.get_nowait()
-        return None
+        try:
+            return self._raw_queue.popleft()
+        except IndexError:
+            return None
     
     def get_sensor_data(self) -> Optional[SensorData]:
         """Get latest sensor data"""
         return self._sensor_data
     
-    def get_status(self) -> Dict[str, Any]:
-        """Get connection status"""
-        return {
+    def _invalidate_status(self):
+        """Rebuild the cached status payload after connection state changes"""
+        self._status_cache = {
             "connected": self._connected,
             "connection_type": self._connection_type.value if self._connection_type else None,
             "port": self._port,
@@ -331,6 +422,10 @@ class DeviceManager:
             "mqtt_broker": self._mqtt_broker,
         }
     
+    def get_status(self) -> Dict[str, Any]:
+        """Get connection status (shared dict; callers must not mutate it)"""
+        return self._status_cache
+    
     def on_data(self, callback: Callable[[Dict], None]):
         """Register callback for incoming data"""
         self._data_callback = callback
@@ -340,6 +435,11 @@ class DeviceManager:
         if not SERIAL_AVAILABLE:
             return []
         
+        # Enumerating ports walks sysfs/udev; the UI polls this, so reuse a recent scan
+        now = time.monotonic()
+        if self._ports_cache is not None and now - self._ports_cache_ts < SERIAL_PORTS_CACHE_TTL:
+            return self._ports_cache
+        
         ports = []
         for port in serial.tools.list_ports.comports():
             ports.append({
@@ -347,6 +447,8 @@ class DeviceManager:
                 "description": port.description,
                 "hwid": port.hwid
             })
+        self._ports_cache = ports
+        self._ports_cache_ts = now
         return ports
 
 
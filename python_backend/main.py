@@ -6,14 +6,22 @@ Complete Python backend with storage, AI, compilers, and device communication
 import asyncio
 import json
 import logging
-import uuid
-from typing import Optional, List, Dict, Any
+import os
+import sys
+import itertools
+import time
+import weakref
+from collections import deque
+from typing import Optional, List, Dict, Any, Awaitable, Callable, Deque, Iterable, Tuple
 from contextlib import asynccontextmanager
 from datetime import datetime
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Response
+import orjson
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, ValidationError
 
 from esp32_communicator import (
     device_manager,
@@ -22,6 +30,7 @@ from esp32_communicator import (
 )
 from storage import (
     storage,
+    SNAPSHOT_PATH,
     InsertProject,
     InsertCodeFile,
     InsertDevice,
@@ -33,17 +42,82 @@ from ai_routes import router as ai_router
 from compiler_routes import router as compiler_router
 from database_routes import router as database_router
 
+# Optional Redis pub/sub for sharing broadcasts across workers
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Store active WebSocket connections
-websocket_clients: List[WebSocket] = []
+# Event loop for uvicorn.run(); uvloop is POSIX-only, so Windows keeps the
+# stdlib asyncio loop
+UVICORN_LOOP = "asyncio" if sys.platform == "win32" else "uvloop"
+
+# Store active WebSocket connections and their outbound queues
+websocket_clients: Dict[WebSocket, "ClientSession"] = {}
+
+# When set (and redis is installed), broadcasts go through this Redis channel
+# so every worker process fans them out to its own clients
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_CHANNEL = "ucodelab:events"
+
+# Frames waiting to be published to Redis; None while Redis fan-out is off.
+# Bounded like the per-client queues: when Redis falls behind, telemetry is
+# dropped and other frames are delivered to this worker's clients directly
+redis_outbox: Optional[asyncio.Queue] = None
+REDIS_OUTBOX_SIZE = 1024
+
+# Frames queued per client before a slow consumer starts losing them
+CLIENT_QUEUE_SIZE = 256
+
+# High-rate telemetry that a lagging client can afford to miss
+DROPPABLE_MESSAGE_TYPES = frozenset({"data", "data_batch", "sensor_update"})
+
+# "data" frames waiting to be broadcast, already encoded as JSON objects;
+# flushed about once per frame (~16ms) as one data_batch whose samples are
+# exactly the frames that would otherwise have been sent one by one.
+# Created per lifespan so it always belongs to the running event loop
+pending_samples: Optional[asyncio.Queue] = None
+SAMPLE_BATCH_INTERVAL = 0.016
+DATA_BATCH_TEMPLATE = '{"type":"data_batch","samples":[%s]}'
+
+# Distinguishes this process from earlier runs; prefixes log event ids (a
+# counter, cheaper than uuid4) and ETags, so neither collides across restarts
+# for clients that stay open.
+PROCESS_TOKEN = f"{os.getpid():x}{time.time_ns():x}"
+_event_ids = itertools.count()
+
+# Keepalive reply; static, so it is encoded once
+PONG_FRAME = orjson.dumps({"type": "pong"}).decode()
+
+# Static endpoint bodies, encoded once at import
+ROOT_BODY = orjson.dumps({"status": "online", "service": "µCodeLab v2.0"})
+PROTOCOLS_BODY = orjson.dumps({
+    "protocols": [
+        {"id": "serial", "name": "USB Serial", "description": "Direct USB/UART connection", "requires": ["port", "baud_rate"]},
+        {"id": "wifi", "name": "WiFi (HTTP)", "description": "HTTP REST API over WiFi", "requires": ["ip_address", "http_port"]},
+        {"id": "mqtt", "name": "MQTT", "description": "MQTT publish/subscribe", "requires": ["mqtt_broker", "mqtt_port", "mqtt_topic_prefix"]}
+    ]
+})
+
+# Connection types accepted by /api/connect
+CONN_TYPE_MAP: Dict[str, ConnectionType] = {
+    "serial": ConnectionType.SERIAL,
+    "wifi": ConnectionType.WIFI,
+    "websocket": ConnectionType.WEBSOCKET,
+    "mqtt": ConnectionType.MQTT
+}
 
 
 # ============== Pydantic Models ==============
 
 class ConnectionConfig(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     connection_type: str
     port: Optional[str] = None
     baud_rate: Optional[int] = 115200
@@ -56,63 +130,253 @@ class ConnectionConfig(BaseModel):
 
 
 class RawDataRequest(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     data: str
 
 
 class CommandRequest(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     command: str
     value: Optional[Any] = None
 
 
 class CommandResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     success: bool
     message: str
     data: Optional[Dict[str, Any]] = None
 
 
+# ============== Responses ==============
+
+class ORJSONResponse(Response):
+    """JSON response rendered with orjson instead of the stdlib encoder"""
+    media_type = "application/json"
+    
+    def render(self, content: Any) -> bytes:
+        try:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson rejects integers wider than 64 bits
+            return json.dumps(content, default=str).encode()
+
+
 # ============== WebSocket Broadcasting ==============
 
+def next_event_id() -> str:
+    """Unique id for a broadcast log event (safe from device threads)"""
+    return f"{PROCESS_TOKEN}-{next(_event_ids)}"
+
+
+async def send_json(websocket: WebSocket, data: Dict):
+    """Send a JSON text frame encoded with orjson"""
+    await websocket.send_text(orjson.dumps(data).decode())
+
+
+class ClientSession:
+    """A connected WebSocket client with a bounded outbound queue
+    
+    Broadcasts only enqueue; a per-client writer task drains the queue, so a
+    slow client never holds up the others and its backlog can't grow without
+    bound. When the queue is full, a droppable telemetry frame makes room by
+    evicting the oldest queued telemetry frame; log, status and link events
+    are never dropped. A non-droppable frame arriving at a full queue means
+    the client is hopelessly behind and it gets disconnected.
+    """
+    
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        # (frame, droppable) in send order
+        self.queue: Deque[Tuple[str, bool]] = deque()
+        self._ready = asyncio.Event()
+        self.writer_task = asyncio.create_task(self._write_loop())
+    
+    async def _write_loop(self):
+        try:
+            while True:
+                while not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                message, _ = self.queue.popleft()
+                await self.websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            websocket_clients.pop(self.websocket, None)
+    
+    def enqueue(self, message: str, droppable: bool) -> bool:
+        """Queue a frame; returns False if the client can't keep up"""
+        if len(self.queue) >= CLIENT_QUEUE_SIZE:
+            if not droppable:
+                return False
+            for i, (_, queued_droppable) in enumerate(self.queue):
+                if queued_droppable:
+                    del self.queue[i]
+                    break
+            else:
+                # Backlog is all events that must be delivered; skip this sample
+                return True
+        self.queue.append((message, droppable))
+        self._ready.set()
+        return True
+    
+    def close(self):
+        self.writer_task.cancel()
+    
+    async def disconnect(self):
+        """Drop a client that fell too far behind (1013: try again later)"""
+        self.close()
+        try:
+            await self.websocket.close(code=1013)
+        except Exception:
+            pass
+
+
+# Last status dict seen and its encoded frame; DeviceManager swaps in a new
+# dict whenever the connection state changes
+_status_frame_cache: Dict[str, Any] = {"status": None, "frame": ""}
+
+
+def status_frame() -> str:
+    """Encoded status frame, re-encoded only when the device status changes"""
+    status = device_manager.get_status()
+    if _status_frame_cache["status"] is not status:
+        _status_frame_cache["frame"] = orjson.dumps({"type": "status", "payload": status}).decode()
+        _status_frame_cache["status"] = status
+    return _status_frame_cache["frame"]
+
+
 async def broadcast_to_websockets(data: Dict):
     """Broadcast data to all connected WebSocket clients"""
-    if not websocket_clients:
+    if not has_listeners():
         return
     
-    message = json.dumps(data)
-    disconnected = []
-    
-    for client in websocket_clients:
+    # Encode once for all clients; frames stay text since the frontend parses event.data
+    broadcast_message(
+        orjson.dumps(data).decode(),
+        droppable=data.get("type") in DROPPABLE_MESSAGE_TYPES
+    )
+
+
+def has_listeners() -> bool:
+    """Whether a broadcast can reach anyone; with Redis, other workers' clients count"""
+    return redis_outbox is not None or bool(websocket_clients)
+
+
+def broadcast_message(message: str, droppable: bool = False):
+    """Broadcast an already-encoded JSON text frame, via Redis when enabled"""
+    if redis_outbox is not None:
         try:
-            await client.send_text(message)
-        except Exception:
-            disconnected.append(client)
+            redis_outbox.put_nowait((message, droppable))
+            return
+        except asyncio.QueueFull:
+            if droppable:
+                return
+            logger.warning("Redis publish backlog full, broadcasting locally")
+    fanout_local(message, droppable)
+
+
+def fanout_local(message: str, droppable: bool = False):
+    """Queue an already-encoded JSON text frame for every client of this worker"""
+    for websocket, session in list(websocket_clients.items()):
+        if not session.enqueue(message, droppable):
+            logger.warning("Disconnecting WebSocket client that fell too far behind")
+            websocket_clients.pop(websocket, None)
+            asyncio.create_task(session.disconnect())
+
+
+def get_event_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """Event loop captured at startup, or None before startup/after shutdown"""
+    loop: Optional[asyncio.AbstractEventLoop] = getattr(app.state, "loop", None)
+    if loop is None or loop.is_closed():
+        return None
+    return loop
+
+
+def schedule_broadcast(data: Dict):
+    """Schedule a broadcast from any thread (serial reader, MQTT callback)
+    
+    Device callbacks run outside the event loop thread. The frame is encoded
+    here, on the calling thread, and only the enqueue is handed to the loop
+    captured at startup - no task per event.
+    """
+    loop = get_event_loop()
+    if loop and has_listeners():
+        loop.call_soon_threadsafe(
+            broadcast_message,
+            orjson.dumps(data).decode(),
+            data.get("type") in DROPPABLE_MESSAGE_TYPES
+        )
+
+
+async def flush_pending_samples(queue: asyncio.Queue):
+    """Coalesce queued sensor samples into one data_batch frame per tick"""
+    while True:
+        batch = [await queue.get()]
+        await asyncio.sleep(SAMPLE_BATCH_INTERVAL)
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        if has_listeners():
+            # Samples are pre-encoded, so the batch frame is a plain join
+            broadcast_message(DATA_BATCH_TEMPLATE % ",".join(batch), droppable=True)
+
+
+def queue_sample(frame: Dict):
+    """Queue a data frame from any thread for the next data_batch
     
-    for client in disconnected:
-        if client in websocket_clients:
-            websocket_clients.remove(client)
+    The frame is encoded on the calling thread; the flusher only joins.
+    """
+    loop = get_event_loop()
+    queue = pending_samples
+    if loop and queue is not None and has_listeners():
+        loop.call_soon_threadsafe(queue.put_nowait, orjson.dumps(frame).decode())
 
 
 def broadcast_device_data(device_id: str, sensor: str, value: float, unit: str):
-    """Broadcast real device data"""
-    asyncio.create_task(broadcast_to_websockets({
+    """Broadcast real device data (batched with other samples in the same tick)"""
+    queue_sample({
         "type": "data",
         "deviceId": device_id,
         "sensor": sensor,
         "value": value,
-        "timestamp": int(datetime.now().timestamp() * 1000),
+        "timestamp": time.time_ns() // 1_000_000,
         "unit": unit,
-    }))
+    })
 
 
 def broadcast_device_log(level: str, message: str, source: str):
     """Broadcast real device log"""
-    asyncio.create_task(broadcast_to_websockets({
+    schedule_broadcast({
         "type": "log",
-        "id": str(uuid.uuid4()),
+        "id": next_event_id(),
         "level": level,
         "message": message,
         "source": source,
         "timestamp": datetime.now().isoformat(),
-    }))
+    })
+
+
+async def publish_to_redis(client):
+    """Publish queued frames to the shared Redis channel"""
+    while True:
+        message, droppable = await redis_outbox.get()
+        try:
+            # One flag character carries the drop policy to the other workers
+            await client.publish(REDIS_CHANNEL, ("1" if droppable else "0") + message)
+        except Exception as e:
+            logger.error(f"Redis publish failed, broadcasting locally: {e}")
+            fanout_local(message, droppable)
+
+
+async def subscribe_from_redis(pubsub):
+    """Fan out frames published by any worker to this worker's clients"""
+    async for item in pubsub.listen():
+        if item["type"] == "message":
+            data = item["data"]
+            fanout_local(data[1:], data[0] == "1")
 
 
 # ============== Lifespan ==============
@@ -120,16 +384,72 @@ def broadcast_device_log(level: str, message: str, source: str):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting µCodeLab Python Backend...")
+    app.state.loop = asyncio.get_running_loop()
     
     def on_device_data(data: Dict):
-        asyncio.create_task(broadcast_to_websockets({"type": "data", "payload": data}))
+        queue_sample({"type": "data", "payload": data})
+    
+    def on_redis_task_done(task: asyncio.Task):
+        """Fall back to local broadcasting if a Redis task stops on its own"""
+        global redis_outbox
+        if task.cancelled() or redis_outbox is None:
+            return
+        logger.error(f"Redis fan-out stopped ({task.exception()!r}), broadcasting locally")
+        outbox, redis_outbox = redis_outbox, None
+        while not outbox.empty():
+            fanout_local(*outbox.get_nowait())
+        for other in redis_tasks:
+            other.cancel()
     
+    def on_sample_flusher_done(task: asyncio.Task):
+        """Report a flusher that died instead of dropping samples silently"""
+        if not task.cancelled():
+            logger.error(f"Sample flusher stopped: {task.exception()!r}")
+    
+    global pending_samples, redis_outbox
+    pending_samples = asyncio.Queue()
     device_manager.on_data(on_device_data)
+    sample_flusher = asyncio.create_task(flush_pending_samples(pending_samples))
+    sample_flusher.add_done_callback(on_sample_flusher_done)
+    
+    redis_client = None
+    redis_tasks: List[asyncio.Task] = []
+    if REDIS_URL:
+        if not REDIS_AVAILABLE:
+            logger.warning("REDIS_URL is set but redis is not installed; broadcasting locally")
+        else:
+            redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+            try:
+                pubsub = redis_client.pubsub()
+                await pubsub.subscribe(REDIS_CHANNEL)
+            except Exception as e:
+                logger.error(f"Redis unavailable, broadcasting locally: {e}")
+                await redis_client.aclose()
+                redis_client = None
+            else:
+                redis_outbox = asyncio.Queue(maxsize=REDIS_OUTBOX_SIZE)
+                redis_tasks = [
+                    asyncio.create_task(publish_to_redis(redis_client)),
+                    asyncio.create_task(subscribe_from_redis(pubsub)),
+                ]
+                for task in redis_tasks:
+                    task.add_done_callback(on_redis_task_done)
+                logger.info(f"Sharing broadcasts over Redis channel {REDIS_CHANNEL}")
     
     yield
     
     logger.info("Shutting down...")
-    device_manager.disconnect()
+    sample_flusher.cancel()
+    pending_samples = None
+    for task in redis_tasks:
+        task.cancel()
+    redis_outbox = None
+    if redis_client:
+        await redis_client.aclose()
+    await asyncio.to_thread(device_manager.disconnect)
+    if SNAPSHOT_PATH:
+        storage.save_snapshot(SNAPSHOT_PATH)
+        logger.info(f"Saved storage snapshot to {SNAPSHOT_PATH}")
 
 
 # ============== Create App ==============
@@ -138,7 +458,8 @@ app = FastAPI(
     title="µCodeLab API",
     description="Complete Python backend for µCodeLab v2.0",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS
@@ -160,15 +481,94 @@ app.include_router(database_router)
 
 @app.get("/")
 async def root():
-    return {"status": "online", "service": "µCodeLab v2.0"}
+    return Response(content=ROOT_BODY, media_type="application/json")
+
+
+# Encoded JSON per stored model instance, keyed by id(). Storage replaces a
+# model on every update rather than mutating it, so an instance's encoding
+# never goes stale; the entry is dropped when the instance is collected.
+_model_json_cache: Dict[int, bytes] = {}
+
+
+def model_json(model: BaseModel) -> bytes:
+    """JSON encoding of a model, computed once per instance"""
+    key = id(model)
+    encoded = _model_json_cache.get(key)
+    if encoded is None:
+        # pydantic-core writes the JSON bytes directly, without an intermediate dict
+        encoded = model.__pydantic_serializer__.to_json(model)
+        _model_json_cache[key] = encoded
+        weakref.finalize(model, _model_json_cache.pop, key, None)
+    return encoded
+
+
+# Lists longer than this are streamed as a chunked JSON array
+LARGE_RESPONSE_ITEMS = 500
+STREAM_CHUNK_ITEMS = 64
+
+
+def model_response(model: BaseModel) -> Response:
+    """Serve one stored model from its cached encoding"""
+    return Response(content=model_json(model), media_type="application/json")
+
+
+def models_response(models: Iterable[BaseModel]) -> Response:
+    """Serve models as a JSON array assembled from cached encodings
+    
+    Consumes `models` in one go, so storage views and generators can be
+    passed straight in.
+    """
+    return Response(
+        content=b"[" + b",".join(model_json(m) for m in models) + b"]",
+        media_type="application/json"
+    )
+
+
+# collection -> (etag, scope, body) of the last list served; one entry per
+# collection, so arbitrary scopes from the URL cannot grow it
+_collection_body_cache: Dict[str, tuple] = {}
+
+
+def versioned_models_response(
+    request: Request,
+    collection: str,
+    models: Callable[[], Iterable[BaseModel]],
+    scope: str = "",
+) -> Response:
+    """models_response with an ETag from the storage write counter
+    
+    Returns 304 without building the list when the client's copy is current,
+    and reuses the previous body until the collection is written again.
+    `scope` separates lists drawn from the same collection (e.g. per project).
+    The etag includes a per-process token so a restart (fresh sample data,
+    counters back at zero) never matches an old copy.
+    """
+    etag = f'W/"{collection}-{PROCESS_TOKEN}-{storage.get_version(collection)}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    cached = _collection_body_cache.get(collection)
+    if cached is not None and cached[0] == etag and cached[1] == scope:
+        body = cached[2]
+    else:
+        body = models_response(models()).body
+        _collection_body_cache[collection] = (etag, scope, body)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+async def stream_models(models: List[BaseModel]):
+    """Yield a JSON array of models a chunk at a time"""
+    yield b"["
+    for start in range(0, len(models), STREAM_CHUNK_ITEMS):
+        chunk = b",".join(model_json(m) for m in models[start:start + STREAM_CHUNK_ITEMS])
+        yield chunk if start == 0 else b"," + chunk
+    yield b"]"
 
 
 # ============== Projects API ==============
 
 @app.get("/api/projects")
-async def get_projects():
-    projects = storage.get_projects()
-    return [p.model_dump() for p in projects]
+async def get_projects(request: Request):
+    return versioned_models_response(request, "projects", storage.get_projects)
 
 
 @app.get("/api/projects/{project_id}")
@@ -176,7 +576,7 @@ async def get_project(project_id: str):
     project = storage.get_project(project_id)
     if not project:
         raise HTTPException(404, "Project not found")
-    return project.model_dump()
+    return model_response(project)
 
 
 @app.post("/api/projects", status_code=201)
@@ -187,7 +587,10 @@ async def create_project(data: InsertProject):
 
 @app.patch("/api/projects/{project_id}")
 async def update_project(project_id: str, updates: dict):
-    project = storage.update_project(project_id, updates)
+    try:
+        project = storage.update_project(project_id, updates)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
     if not project:
         raise HTTPException(404, "Project not found")
     return project.model_dump()
@@ -205,8 +608,7 @@ async def delete_project(project_id: str):
 
 @app.get("/api/projects/{project_id}/files")
 async def get_project_files(project_id: str):
-    files = storage.get_project_files(project_id)
-    return [f.model_dump() for f in files]
+    return models_response(storage.get_project_files(project_id))
 
 
 @app.post("/api/projects/{project_id}/files", status_code=201)
@@ -223,7 +625,10 @@ async def create_code_file(project_id: str, data: dict):
 
 @app.patch("/api/projects/{project_id}/files/{file_id}")
 async def update_code_file(project_id: str, file_id: str, updates: dict):
-    code_file = storage.update_code_file(file_id, updates)
+    try:
+        code_file = storage.update_code_file(file_id, updates)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
     if not code_file:
         raise HTTPException(404, "File not found")
     return code_file.model_dump()
@@ -240,9 +645,8 @@ async def delete_code_file(project_id: str, file_id: str):
 # ============== Devices API ==============
 
 @app.get("/api/devices")
-async def get_devices():
-    devices = storage.get_devices()
-    return [d.model_dump() for d in devices]
+async def get_devices(request: Request):
+    return versioned_models_response(request, "devices", storage.get_devices)
 
 
 @app.get("/api/devices/{device_id}")
@@ -250,7 +654,7 @@ async def get_device(device_id: str):
     device = storage.get_device(device_id)
     if not device:
         raise HTTPException(404, "Device not found")
-    return device.model_dump()
+    return model_response(device)
 
 
 @app.post("/api/devices", status_code=201)
@@ -261,7 +665,10 @@ async def create_device(data: InsertDevice):
 
 @app.patch("/api/devices/{device_id}")
 async def update_device(device_id: str, updates: dict):
-    device = storage.update_device(device_id, updates)
+    try:
+        device = storage.update_device(device_id, updates)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
     if not device:
         raise HTTPException(404, "Device not found")
     return device.model_dump()
@@ -281,7 +688,7 @@ async def delete_device(device_id: str):
 async def get_device_links(device_id: str):
     """Get all links for a device"""
     links = storage.get_device_links(device_id=device_id)
-    return [l.model_dump() for l in links]
+    return models_response(links)
 
 
 @app.post("/api/devices/{device_id}/links", status_code=201)
@@ -328,7 +735,7 @@ async def delete_device_link(device_id: str, link_id: str):
 async def get_project_devices(project_id: str):
     """Get all devices linked to a project"""
     devices = storage.get_project_devices(project_id)
-    return [d.model_dump() for d in devices]
+    return models_response(devices)
 
 
 # ============== Device Sensor Data API ==============
@@ -355,8 +762,7 @@ async def update_device_sensors(device_id: str, data: dict):
         raise HTTPException(404, "Device not found")
     
     # Store in history
-    for sensor_name, value in data.items():
-        storage.add_sensor_reading(device_id, sensor_name, value)
+    storage.add_sensor_readings(device_id, data)
     
     # Broadcast sensor update
     await broadcast_to_websockets({
@@ -373,7 +779,10 @@ async def update_device_sensors(device_id: str, data: dict):
 async def get_sensor_history(device_id: str, sensor: str = None, limit: int = 100):
     """Get sensor history for a device"""
     history = storage.get_sensor_history(device_id, sensor, limit)
-    return [h.model_dump() for h in history]
+    if len(history) > LARGE_RESPONSE_ITEMS:
+        # Stream long histories so the loop gets control back between chunks
+        return StreamingResponse(stream_models(history), media_type="application/json")
+    return models_response(history)
 
 
 # ============== Code Bindings API ==============
@@ -382,7 +791,7 @@ async def get_sensor_history(device_id: str, sensor: str = None, limit: int = 10
 async def get_device_bindings(device_id: str):
     """Get code bindings for a device"""
     bindings = storage.get_code_bindings(device_id=device_id)
-    return [b.model_dump() for b in bindings]
+    return models_response(bindings)
 
 
 @app.post("/api/devices/{device_id}/bindings", status_code=201)
@@ -414,7 +823,7 @@ async def delete_binding(binding_id: str):
 async def get_file_bindings(project_id: str, file_id: str):
     """Get code bindings for a file"""
     bindings = storage.get_code_bindings(code_file_id=file_id)
-    return [b.model_dump() for b in bindings]
+    return models_response(bindings)
 
 
 # ============== GPIO Control API ==============
@@ -422,15 +831,14 @@ async def get_file_bindings(project_id: str, file_id: str):
 @app.post("/api/devices/{device_id}/gpio/{pin}")
 async def control_gpio(device_id: str, pin: int, data: dict):
     """Control a GPIO pin on a device"""
-    device = storage.get_device(device_id)
-    if not device:
+    if not storage.device_exists(device_id):
         raise HTTPException(404, "Device not found")
     
     value = data.get("value", 0)
     mode = data.get("mode", "output")  # output, input, pwm
     
     # Send command to device
-    result = device_manager.send_command("gpio_write", {
+    result = await device_manager.send_command_async("gpio_write", {
         "pin": pin,
         "value": value,
         "mode": mode
@@ -456,11 +864,10 @@ async def control_gpio(device_id: str, pin: int, data: dict):
 @app.get("/api/devices/{device_id}/gpio/{pin}")
 async def read_gpio(device_id: str, pin: int):
     """Read a GPIO pin value from a device"""
-    device = storage.get_device(device_id)
-    if not device:
+    if not storage.device_exists(device_id):
         raise HTTPException(404, "Device not found")
     
-    result = device_manager.send_command("gpio_read", {"pin": pin})
+    result = await device_manager.send_command_async("gpio_read", {"pin": pin})
     
     return {
         "success": result.success,
@@ -474,13 +881,12 @@ async def read_gpio(device_id: str, pin: int):
 @app.post("/api/devices/{device_id}/functions/{function_name}")
 async def execute_function(device_id: str, function_name: str, data: dict = None):
     """Execute a function on a device"""
-    device = storage.get_device(device_id)
-    if not device:
+    if not storage.device_exists(device_id):
         raise HTTPException(404, "Device not found")
     
     params = data.get("params", []) if data else []
     
-    result = device_manager.send_command("call_function", {
+    result = await device_manager.send_command_async("call_function", {
         "function": function_name,
         "params": params
     })
@@ -507,11 +913,10 @@ async def execute_function(device_id: str, function_name: str, data: dict = None
 @app.get("/api/devices/{device_id}/variables/{variable_name}")
 async def get_variable(device_id: str, variable_name: str):
     """Get a variable value from a device"""
-    device = storage.get_device(device_id)
-    if not device:
+    if not storage.device_exists(device_id):
         raise HTTPException(404, "Device not found")
     
-    result = device_manager.send_command("get_variable", {"name": variable_name})
+    result = await device_manager.send_command_async("get_variable", {"name": variable_name})
     
     return {
         "success": result.success,
@@ -523,13 +928,12 @@ async def get_variable(device_id: str, variable_name: str):
 @app.post("/api/devices/{device_id}/variables/{variable_name}")
 async def set_variable(device_id: str, variable_name: str, data: dict):
     """Set a variable value on a device"""
-    device = storage.get_device(device_id)
-    if not device:
+    if not storage.device_exists(device_id):
         raise HTTPException(404, "Device not found")
     
     value = data.get("value")
     
-    result = device_manager.send_command("set_variable", {
+    result = await device_manager.send_command_async("set_variable", {
         "name": variable_name,
         "value": value
     })
@@ -616,9 +1020,10 @@ async def bulk_link_operations(data: dict):
 # ============== Dashboards API ==============
 
 @app.get("/api/projects/{project_id}/dashboards")
-async def get_project_dashboards(project_id: str):
-    dashboards = storage.get_project_dashboards(project_id)
-    return [d.model_dump() for d in dashboards]
+async def get_project_dashboards(request: Request, project_id: str):
+    return versioned_models_response(
+        request, "dashboards", lambda: storage.get_project_dashboards(project_id), scope=project_id
+    )
 
 
 @app.post("/api/projects/{project_id}/dashboards", status_code=201)
@@ -635,7 +1040,10 @@ async def create_dashboard(project_id: str, data: dict):
 
 @app.patch("/api/projects/{project_id}/dashboards/{dashboard_id}")
 async def update_dashboard(project_id: str, dashboard_id: str, updates: dict):
-    dashboard = storage.update_dashboard(dashboard_id, updates)
+    try:
+        dashboard = storage.update_dashboard(dashboard_id, updates)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
     if not dashboard:
         raise HTTPException(404, "Dashboard not found")
     return dashboard.model_dump()
@@ -664,28 +1072,16 @@ async def list_serial_ports():
 
 @app.post("/api/connect")
 async def connect_device(config: ConnectionConfig):
+    conn_type = CONN_TYPE_MAP.get(config.connection_type.lower())
+    if not conn_type:
+        raise HTTPException(400, f"Invalid connection type: {config.connection_type}")
+    
     try:
-        conn_type_map = {
-            "serial": ConnectionType.SERIAL,
-            "wifi": ConnectionType.WIFI,
-            "websocket": ConnectionType.WEBSOCKET,
-            "mqtt": ConnectionType.MQTT
-        }
-        
-        conn_type = conn_type_map.get(config.connection_type.lower())
-        if not conn_type:
-            raise HTTPException(400, f"Invalid connection type: {config.connection_type}")
-        
+        # Empty, zero or null fields fall back to configure()'s own defaults
+        settings = config.model_dump(exclude={"connection_type"})
         device_manager.configure(
             connection_type=conn_type,
-            port=config.port or "",
-            baud_rate=config.baud_rate or 115200,
-            ip_address=config.ip_address or "192.168.1.100",
-            http_port=config.http_port or 80,
-            ws_port=config.ws_port or 81,
-            mqtt_broker=config.mqtt_broker or "broker.hivemq.com",
-            mqtt_port=config.mqtt_port or 1883,
-            mqtt_topic_prefix=config.mqtt_topic_prefix or "ucodelab/esp32"
+            **{name: value for name, value in settings.items() if value}
         )
         
         success = device_manager.connect(conn_type)
@@ -706,13 +1102,13 @@ async def connect_device(config: ConnectionConfig):
 
 @app.post("/api/disconnect")
 async def disconnect_device():
-    device_manager.disconnect()
+    await asyncio.to_thread(device_manager.disconnect)
     return {"success": True, "message": "Disconnected"}
 
 
 @app.post("/api/command", response_model=CommandResponse)
 async def send_command(request: CommandRequest):
-    result = device_manager.send_command(request.command, request.value)
+    result = await device_manager.send_command_async(request.command, request.value)
     return CommandResponse(
         success=result.success,
         message=result.message,
@@ -741,7 +1137,7 @@ async def get_sensor_data():
 
 @app.post("/api/raw")
 async def send_raw_data(request: RawDataRequest):
-    result = device_manager.send_raw(request.data)
+    result = await device_manager.send_raw_async(request.data)
     return CommandResponse(success=result.success, message=result.message)
 
 
@@ -755,28 +1151,54 @@ async def read_raw_data():
 
 @app.get("/api/protocols")
 async def get_supported_protocols():
-    return {
-        "protocols": [
-            {"id": "serial", "name": "USB Serial", "description": "Direct USB/UART connection", "requires": ["port", "baud_rate"]},
-            {"id": "wifi", "name": "WiFi (HTTP)", "description": "HTTP REST API over WiFi", "requires": ["ip_address", "http_port"]},
-            {"id": "mqtt", "name": "MQTT", "description": "MQTT publish/subscribe", "requires": ["mqtt_broker", "mqtt_port", "mqtt_topic_prefix"]}
-        ]
-    }
+    return Response(content=PROTOCOLS_BODY, media_type="application/json")
 
 
 # ============== WebSocket Endpoint ==============
 
+async def handle_ws_command(websocket: WebSocket, payload: Dict):
+    result = await device_manager.send_command_async(
+        payload.get("command"),
+        payload.get("value")
+    )
+    await send_json(websocket, {
+        "type": "command_result",
+        "payload": {
+            "success": result.success,
+            "message": result.message,
+            "data": result.data
+        }
+    })
+
+
+async def handle_ws_get_status(websocket: WebSocket, payload: Dict):
+    await websocket.send_text(status_frame())
+
+
+async def handle_ws_ping(websocket: WebSocket, payload: Dict):
+    await websocket.send_text(PONG_FRAME)
+
+
+# Client message type -> handler(websocket, payload)
+WS_HANDLERS: Dict[str, Callable[[WebSocket, Dict], Awaitable[None]]] = {
+    "command": handle_ws_command,
+    "get_status": handle_ws_get_status,
+    "ping": handle_ws_ping,
+}
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    websocket_clients.append(websocket)
+    session = ClientSession(websocket)
+    websocket_clients[websocket] = session
     logger.info(f"WebSocket client connected. Total: {len(websocket_clients)}")
     
     try:
         # Send initial connection message
-        await websocket.send_json({
+        await send_json(websocket, {
             "type": "log",
-            "id": str(uuid.uuid4()),
+            "id": next_event_id(),
             "level": "info",
             "message": "Connected to µCodeLab server - waiting for device connection",
             "source": "server",
@@ -784,52 +1206,38 @@ async def websocket_endpoint(websocket: WebSocket):
         })
         
         # Send current status
-        await websocket.send_json({
-            "type": "status",
-            "payload": device_manager.get_status()
-        })
+        await websocket.send_text(status_frame())
         
         while True:
             data = await websocket.receive_text()
-            message = json.loads(data)
+            message = orjson.loads(data)
             
             msg_type = message.get("type")
             payload = message.get("payload", {})
             
-            if msg_type == "command":
-                result = device_manager.send_command(
-                    payload.get("command"),
-                    payload.get("value")
-                )
-                await websocket.send_json({
-                    "type": "command_result",
-                    "payload": {
-                        "success": result.success,
-                        "message": result.message,
-                        "data": result.data
-                    }
-                })
-            
-            elif msg_type == "get_status":
-                await websocket.send_json({
-                    "type": "status",
-                    "payload": device_manager.get_status()
-                })
-            
-            elif msg_type == "ping":
-                await websocket.send_json({"type": "pong"})
-                
+            handler = WS_HANDLERS.get(msg_type)
+            if handler:
+                await handler(websocket, payload)
+    
     except WebSocketDisconnect:
         logger.info("WebSocket client disconnected")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
     finally:
-        if websocket in websocket_clients:
-            websocket_clients.remove(websocket)
+        websocket_clients.pop(websocket, None)
+        session.close()
 
 
 # ============== Run ==============
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        loop=UVICORN_LOOP,
+        http="httptools",
+        ws="websockets"
+    )
@@ -24,6 +24,8 @@ print(f"[ENV] NVIDIA_API_KEY set: {bool(os.environ.get('NVIDIA_API_KEY'))}")
 def check_dependencies():
     """Check if required packages are installed"""
     required = ['fastapi', 'uvicorn', 'serial', 'paho.mqtt']
+    if sys.platform != "win32":
+        required.append('uvloop')
     missing = []
     
     for package in required:
@@ -46,6 +48,7 @@ def main():
     check_dependencies()
     
     import uvicorn
+    from main import UVICORN_LOOP
     
     print("=" * 50)
     print("µCodeLab Python Communication Backend")
@@ -63,7 +66,10 @@ def main():
         port=8001,
         reload=False,
         log_level="info",
-        access_log=True
+        access_log=True,
+        loop=UVICORN_LOOP,
+        http="httptools",
+        ws="websockets"
     )
 
 if __name__ == "__main__":
@@ -3,14 +3,27 @@ In-Memory Storage for µCodeLab
 Stores projects, files, devices, and dashboards
 """
 
-import uuid
+import itertools
+import logging
+import os
+import sys
+import time
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
-from pydantic import BaseModel, Field
+from typing import Deque, Dict, Iterable, List, Optional, Any, Tuple
+import orjson
+from pydantic import BaseModel, Field, field_validator
+
+logger = logging.getLogger(__name__)
 
 
 # ============== Pydantic Models ==============
 
+def _intern(value: Any) -> Any:
+    """Share one str object per distinct value for low-cardinality fields"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 class Project(BaseModel):
     id: str
     name: str
@@ -20,6 +33,8 @@ class Project(BaseModel):
     createdAt: str
     updatedAt: str
 
+    _intern_enums = field_validator("hardware", "language", mode="before")(_intern)
+
 
 class InsertProject(BaseModel):
     name: str
@@ -27,6 +42,8 @@ class InsertProject(BaseModel):
     hardware: str
     language: str
 
+    _intern_enums = field_validator("hardware", "language", mode="before")(_intern)
+
 
 class CodeFile(BaseModel):
     id: str
@@ -35,6 +52,8 @@ class CodeFile(BaseModel):
     content: str
     language: str  # arduino, micropython
 
+    _intern_enums = field_validator("language", mode="before")(_intern)
+
 
 class InsertCodeFile(BaseModel):
     projectId: str
@@ -42,6 +61,8 @@ class InsertCodeFile(BaseModel):
     content: str
     language: str
 
+    _intern_enums = field_validator("language", mode="before")(_intern)
+
 
 class Device(BaseModel):
     id: str
@@ -58,6 +79,8 @@ class Device(BaseModel):
     linkedCodeFileId: Optional[str] = None
     connectionType: Optional[str] = None  # serial, wifi, mqtt, websocket
 
+    _intern_enums = field_validator("hardware", "status", "role", "connectionType", mode="before")(_intern)
+
 
 class InsertDevice(BaseModel):
     name: str
@@ -69,6 +92,8 @@ class InsertDevice(BaseModel):
     capabilities: Optional[Dict[str, bool]] = None
     connectionType: Optional[str] = None
 
+    _intern_enums = field_validator("hardware", "status", "role", "connectionType", mode="before")(_intern)
+
 
 class DeviceLink(BaseModel):
     id: str
@@ -81,6 +106,8 @@ class DeviceLink(BaseModel):
     createdAt: str
     lastSync: Optional[str] = None
 
+    _intern_enums = field_validator("role", "status", mode="before")(_intern)
+
 
 class InsertDeviceLink(BaseModel):
     deviceId: str
@@ -89,6 +116,8 @@ class InsertDeviceLink(BaseModel):
     codeFileId: Optional[str] = None
     role: str = "primary"
 
+    _intern_enums = field_validator("role", mode="before")(_intern)
+
 
 class CodeBinding(BaseModel):
     id: str
@@ -100,6 +129,8 @@ class CodeBinding(BaseModel):
     lineNumber: int
     widgetId: Optional[str] = None
 
+    _intern_enums = field_validator("variableType", "annotation", mode="before")(_intern)
+
 
 class InsertCodeBinding(BaseModel):
     codeFileId: str
@@ -110,6 +141,8 @@ class InsertCodeBinding(BaseModel):
     lineNumber: int
     widgetId: Optional[str] = None
 
+    _intern_enums = field_validator("variableType", "annotation", mode="before")(_intern)
+
 
 class WidgetConfig(BaseModel):
     id: str
@@ -166,52 +199,7 @@ class DeviceSensorReading(BaseModel):
 
 # ============== Storage Class ==============
 
-class MemStorage:
-    def __init__(self):
-        self.projects: Dict[str, Project] = {}
-        self.code_files: Dict[str, CodeFile] = {}
-        self.devices: Dict[str, Device] = {}
-        self.dashboards: Dict[str, Dashboard] = {}
-        self.device_links: Dict[str, DeviceLink] = {}
-        self.code_bindings: Dict[str, CodeBinding] = {}
-        self.sensor_history: Dict[str, List[DeviceSensorReading]] = {}
-        self._initialize_sample_data()
-
-    def _initialize_sample_data(self):
-        """Initialize with sample data"""
-        now = datetime.now()
-        
-        # Sample project 1
-        project1 = Project(
-            id="proj-1",
-            name="Smart Home Sensor",
-            description="Temperature and humidity monitoring system",
-            hardware="esp32",
-            language="arduino",
-            createdAt=(now - timedelta(days=7)).isoformat(),
-            updatedAt=(now - timedelta(days=1)).isoformat(),
-        )
-        self.projects[project1.id] = project1
-
-        # Sample project 2
-        project2 = Project(
-            id="proj-2",
-            name="LED Controller",
-            description="RGB LED strip controller with WiFi",
-            hardware="esp8266",
-            language="micropython",
-            createdAt=(now - timedelta(days=14)).isoformat(),
-            updatedAt=(now - timedelta(days=3)).isoformat(),
-        )
-        self.projects[project2.id] = project2
-
-        # Sample code file
-        file1 = CodeFile(
-            id="file-1",
-            projectId="proj-1",
-            name="main.ino",
-            language="arduino",
-            content='''// Smart Home Sensor - Main Sketch
+_SAMPLE_INO = '''// Smart Home Sensor - Main Sketch
 #include <WiFi.h>
 #include <DHT.h>
 
@@ -250,12 +238,251 @@ void toggleLED() {
   ledState = !ledState;
   Serial.println(ledState ? "LED ON" : "LED OFF");
 }
-''',
+'''
+
+
+# Default file bodies for new projects, after the "# <name>" / "// <name>" header
+_MPY_TEMPLATE_SUFFIX = ''' - MicroPython Script
+from machine import Pin
+import time
+
+# @remote_access
+led_state = False
+
+led = Pin(2, Pin.OUT)
+
+def setup():
+    print("Device ready!")
+
+# @remote_function
+def toggle_led():
+    global led_state
+    led_state = not led_state
+    led.value(led_state)
+
+setup()
+while True:
+    led.value(led_state)
+    time.sleep(0.1)
+'''
+
+_ARDUINO_TEMPLATE_SUFFIX = ''' - Arduino Sketch
+
+// @remote_access
+int ledState = LOW;
+
+void setup() {
+  Serial.begin(115200);
+  pinMode(LED_BUILTIN, OUTPUT);
+  Serial.println("Device ready!");
+}
+
+void loop() {
+  digitalWrite(LED_BUILTIN, ledState);
+  delay(100);
+}
+
+// @remote_function
+void toggleLED() {
+  ledState = !ledState;
+}
+'''
+
+
+# (epoch second, its ISO string) for _now_iso
+_last_iso_second: List[Any] = [0, ""]
+
+
+def _now_iso() -> str:
+    """Current local time as ISO, formatted at most once per second
+    
+    Only for presence-style fields (lastSeen, lastSync). Fields that order
+    records or plot readings keep full microsecond timestamps.
+    """
+    second = int(time.time())
+    if second != _last_iso_second[0]:
+        _last_iso_second[1] = datetime.fromtimestamp(second).isoformat()
+        _last_iso_second[0] = second
+    return _last_iso_second[1]
+
+
+def _with_updates(model: BaseModel, updates: dict) -> BaseModel:
+    """Copy of a stored model with the known fields in `updates` replaced
+    
+    Only the updated fields are validated, on the copy, so a bad value raises
+    ValidationError before anything is stored. Unknown keys are dropped, as
+    model construction used to do.
+    """
+    model_type = type(model)
+    fields = model_type.model_fields
+    updated = model.model_copy()
+    for key, value in updates.items():
+        if key in fields:
+            model_type.__pydantic_validator__.validate_assignment(updated, key, value)
+    return updated
+
+
+# Readings kept per device; older ones fall off the front
+SENSOR_HISTORY_SIZE = 1000
+
+
+class MemStorage:
+    def __init__(self, seed: bool = False, snapshot: Optional[str] = None):
+        self.projects: Dict[str, Project] = {}
+        self.code_files: Dict[str, CodeFile] = {}
+        self.devices: Dict[str, Device] = {}
+        self.dashboards: Dict[str, Dashboard] = {}
+        self.device_links: Dict[str, DeviceLink] = {}
+        self.code_bindings: Dict[str, CodeBinding] = {}
+        self.sensor_history: Dict[str, Deque[DeviceSensorReading]] = defaultdict(
+            lambda: deque(maxlen=SENSOR_HISTORY_SIZE)
         )
-        self.code_files[file1.id] = file1
+        # foreign key -> record ids, as insertion-ordered dicts used like sets
+        self._files_by_project: Dict[str, Dict[str, None]] = defaultdict(dict)
+        self._dashboards_by_project: Dict[str, Dict[str, None]] = defaultdict(dict)
+        self._devices_by_project: Dict[str, Dict[str, None]] = defaultdict(dict)
+        self._links_by_device: Dict[str, Dict[str, None]] = defaultdict(dict)
+        self._links_by_project: Dict[str, Dict[str, None]] = defaultdict(dict)
+        self._bindings_by_file: Dict[str, Dict[str, None]] = defaultdict(dict)
+        self._bindings_by_device: Dict[str, Dict[str, None]] = defaultdict(dict)
+        # Write counters for collections whose list responses carry ETags
+        self._versions: Dict[str, int] = {"projects": 0, "devices": 0, "dashboards": 0}
+        # (projects version, projects newest-first); re-sorted only after a write
+        self._projects_sorted: Optional[Tuple[int, Tuple[Project, ...]]] = None
+        # Per-prefix counters for short sequential ids ("proj-3", "dev-7", ...)
+        self._id_counters: Dict[str, Any] = defaultdict(lambda: itertools.count(1))
+        # content -> [shared str, files using it]; identical file bodies share one object
+        self._content_pool: Dict[str, List[Any]] = {}
+        if snapshot and self.load_snapshot(snapshot):
+            return
+        if seed:
+            self._seed()
+
+    def _new_id(self, prefix: str, store: Dict[str, Any]) -> str:
+        """Next free id for a collection, skipping ids already taken (e.g. sample data)"""
+        while True:
+            id = f"{prefix}-{next(self._id_counters[prefix])}"
+            if id not in store:
+                return id
+
+    def _pool_content(self, content: str) -> str:
+        """Shared copy of a file body, counted until the file drops it"""
+        if not isinstance(content, str):
+            return content
+        entry = self._content_pool.get(content)
+        if entry is None:
+            entry = self._content_pool[content] = [content, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _unpool_content(self, content: str):
+        entry = self._content_pool.get(content) if isinstance(content, str) else None
+        if entry is not None:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._content_pool[content]
+
+    def _bump(self, collection: str):
+        self._versions[collection] += 1
+
+    def get_version(self, collection: str) -> int:
+        """Counter that changes whenever the collection is written"""
+        return self._versions[collection]
+
+    def _put_child(self, store: Dict[str, Any], index: Dict[str, Dict[str, None]], child, previous=None):
+        """Store a code file or dashboard and keep its project index in step"""
+        if previous is not None and previous.projectId != child.projectId:
+            self._unindex_child(index, previous.projectId, child.id)
+        store[child.id] = child
+        index[child.projectId][child.id] = None
+
+    def _drop_child(self, store: Dict[str, Any], index: Dict[str, Dict[str, None]], id: str):
+        child = store.pop(id)
+        self._unindex_child(index, child.projectId, id)
+
+    @staticmethod
+    def _remove_keys(store: Dict[str, Any], ids) -> Dict[str, Any]:
+        """Remove `ids` from `store`, returning the dict to keep using
+        
+        When a large share of the dict goes, one filtered rebuild is cheaper
+        than many deletes and leaves a compact table.
+        """
+        if len(ids) * 4 > len(store):
+            return {k: v for k, v in store.items() if k not in ids}
+        for k in ids:
+            del store[k]
+        return store
+
+    @staticmethod
+    def _index(index: Dict[str, Dict[str, None]], key: Optional[str], id: str):
+        if key is not None:
+            index[key][id] = None
+
+    @staticmethod
+    def _unindex_child(index: Dict[str, Dict[str, None]], key: Optional[str], id: str):
+        ids = index.get(key)
+        if ids is not None:
+            ids.pop(id, None)
+            if not ids:
+                del index[key]
+
+    def _reindex(self, index: Dict[str, Dict[str, None]], old_key: Optional[str], new_key: Optional[str], id: str):
+        """Move `id` between index buckets when a record's foreign key changes"""
+        if old_key != new_key:
+            self._unindex_child(index, old_key, id)
+            self._index(index, new_key, id)
+
+    def _index_link(self, link: DeviceLink):
+        self._index(self._links_by_device, link.deviceId, link.id)
+        self._index(self._links_by_project, link.projectId, link.id)
+
+    def _index_binding(self, binding: CodeBinding):
+        self._index(self._bindings_by_file, binding.codeFileId, binding.id)
+        self._index(self._bindings_by_device, binding.deviceId, binding.id)
+
+    def _seed(self):
+        """Populate the demo projects, devices and dashboard
+        
+        The values are fixed literals, so the models are built without validation.
+        """
+        now = datetime.now()
+        
+        # Sample project 1
+        project1 = Project.model_construct(
+            id="proj-1",
+            name="Smart Home Sensor",
+            description="Temperature and humidity monitoring system",
+            hardware="esp32",
+            language="arduino",
+            createdAt=(now - timedelta(days=7)).isoformat(),
+            updatedAt=(now - timedelta(days=1)).isoformat(),
+        )
+        self.projects[project1.id] = project1
+
+        # Sample project 2
+        project2 = Project.model_construct(
+            id="proj-2",
+            name="LED Controller",
+            description="RGB LED strip controller with WiFi",
+            hardware="esp8266",
+            language="micropython",
+            createdAt=(now - timedelta(days=14)).isoformat(),
+            updatedAt=(now - timedelta(days=3)).isoformat(),
+        )
+        self.projects[project2.id] = project2
+
+        # Sample code file
+        file1 = CodeFile.model_construct(
+            id="file-1",
+            projectId="proj-1",
+            name="main.ino",
+            language="arduino",
+            content=self._pool_content(_SAMPLE_INO),
+        )
+        self._put_child(self.code_files, self._files_by_project, file1)
 
         # Sample devices with enhanced data
-        device1 = Device(
+        device1 = Device.model_construct(
             id="dev-1",
             name="Living Room Sensor",
             hardware="esp32",
@@ -270,8 +497,9 @@ void toggleLED() {
             connectionType="wifi",
         )
         self.devices[device1.id] = device1
+        self._index(self._devices_by_project, device1.projectId, device1.id)
 
-        device2 = Device(
+        device2 = Device.model_construct(
             id="dev-2",
             name="Kitchen Controller",
             hardware="esp8266",
@@ -284,7 +512,7 @@ void toggleLED() {
         self.devices[device2.id] = device2
 
         # Sample device link
-        link1 = DeviceLink(
+        link1 = DeviceLink.model_construct(
             id="link-1",
             deviceId="dev-1",
             projectId="proj-1",
@@ -296,9 +524,10 @@ void toggleLED() {
             lastSync=now.isoformat(),
         )
         self.device_links[link1.id] = link1
+        self._index_link(link1)
 
         # Sample code bindings
-        binding1 = CodeBinding(
+        binding1 = CodeBinding.model_construct(
             id="bind-1",
             codeFileId="file-1",
             deviceId="dev-1",
@@ -308,8 +537,9 @@ void toggleLED() {
             lineNumber=12,
         )
         self.code_bindings[binding1.id] = binding1
+        self._index_binding(binding1)
 
-        binding2 = CodeBinding(
+        binding2 = CodeBinding.model_construct(
             id="bind-2",
             codeFileId="file-1",
             deviceId="dev-1",
@@ -320,9 +550,10 @@ void toggleLED() {
             widgetId="w3",
         )
         self.code_bindings[binding2.id] = binding2
+        self._index_binding(binding2)
 
         # Sample dashboard
-        dashboard1 = Dashboard(
+        dashboard1 = Dashboard.model_construct(
             id="dash-1",
             projectId="proj-1",
             name="Main Dashboard",
@@ -339,20 +570,91 @@ void toggleLED() {
                 {"i": "w4", "x": 8, "y": 0, "w": 4, "h": 2},
             ],
         )
-        self.dashboards[dashboard1.id] = dashboard1
+        self._put_child(self.dashboards, self._dashboards_by_project, dashboard1)
+
+    # ============== Snapshots ==============
+
+    def save_snapshot(self, path: str):
+        """Write all records (not sensor history) to `path` as JSON"""
+        data = {
+            "projects": list(self.projects.values()),
+            "code_files": list(self.code_files.values()),
+            "devices": list(self.devices.values()),
+            "dashboards": list(self.dashboards.values()),
+            "device_links": list(self.device_links.values()),
+            "code_bindings": list(self.code_bindings.values()),
+        }
+        encoded = orjson.dumps({name: [m.model_dump() for m in models] for name, models in data.items()})
+        # Write beside the target and swap in, so a crash never leaves half a file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encoded)
+        os.replace(tmp_path, path)
+
+    def load_snapshot(self, path: str) -> bool:
+        """Restore records saved by save_snapshot
+        
+        Everything is parsed and validated before the store is touched. Returns
+        False, leaving the store as it was, if there is no snapshot or it cannot
+        be used; an unusable file is logged and moved aside so the next save
+        does not overwrite it.
+        """
+        try:
+            with open(path, "rb") as f:
+                data = orjson.loads(f.read())
+            projects = [Project.model_validate(item) for item in data.get("projects", [])]
+            code_files = [CodeFile.model_validate(item) for item in data.get("code_files", [])]
+            devices = [Device.model_validate(item) for item in data.get("devices", [])]
+            dashboards = [Dashboard.model_validate(item) for item in data.get("dashboards", [])]
+            links = [DeviceLink.model_validate(item) for item in data.get("device_links", [])]
+            bindings = [CodeBinding.model_validate(item) for item in data.get("code_bindings", [])]
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            # ValueError covers both orjson.JSONDecodeError and pydantic's ValidationError
+            logger.error(f"Ignoring unusable storage snapshot {path}: {e}")
+            try:
+                os.replace(path, f"{path}.bad")
+            except OSError:
+                pass
+            return False
+
+        for project in projects:
+            self.projects[project.id] = project
+        for code_file in code_files:
+            code_file = code_file.model_copy(update={"content": self._pool_content(code_file.content)})
+            self._put_child(self.code_files, self._files_by_project, code_file)
+        for device in devices:
+            self.devices[device.id] = device
+            self._index(self._devices_by_project, device.projectId, device.id)
+        for dashboard in dashboards:
+            self._put_child(self.dashboards, self._dashboards_by_project, dashboard)
+        for link in links:
+            self.device_links[link.id] = link
+            self._index_link(link)
+        for binding in bindings:
+            self.code_bindings[binding.id] = binding
+            self._index_binding(binding)
+        for collection in self._versions:
+            self._bump(collection)
+        return True
 
     # ============== Projects ==============
     
-    def get_projects(self) -> List[Project]:
-        return sorted(self.projects.values(), key=lambda p: p.updatedAt, reverse=True)
+    def get_projects(self) -> Iterable[Project]:
+        version = self._versions["projects"]
+        if self._projects_sorted is None or self._projects_sorted[0] != version:
+            ordered = tuple(sorted(self.projects.values(), key=lambda p: p.updatedAt, reverse=True))
+            self._projects_sorted = (version, ordered)
+        return self._projects_sorted[1]
 
     def get_project(self, id: str) -> Optional[Project]:
         return self.projects.get(id)
 
     def create_project(self, data: InsertProject) -> Project:
         now = datetime.now().isoformat()
-        project = Project(
-            id=str(uuid.uuid4()),
+        project = Project.model_construct(
+            id=self._new_id("proj", self.projects),
             name=data.name,
             description=data.description,
             hardware=data.hardware,
@@ -361,211 +663,195 @@ void toggleLED() {
             updatedAt=now,
         )
         self.projects[project.id] = project
+        self._bump("projects")
 
         # Create default file
         language = "micropython" if data.language == "micropython" else "arduino"
         file_name = "main.py" if language == "micropython" else "main.ino"
         
         if language == "micropython":
-            content = f'''# {data.name} - MicroPython Script
-from machine import Pin
-import time
-
-# @remote_access
-led_state = False
-
-led = Pin(2, Pin.OUT)
-
-def setup():
-    print("Device ready!")
-
-# @remote_function
-def toggle_led():
-    global led_state
-    led_state = not led_state
-    led.value(led_state)
-
-setup()
-while True:
-    led.value(led_state)
-    time.sleep(0.1)
-'''
+            content = "# " + data.name + _MPY_TEMPLATE_SUFFIX
         else:
-            content = f'''// {data.name} - Arduino Sketch
-
-// @remote_access
-int ledState = LOW;
-
-void setup() {{
-  Serial.begin(115200);
-  pinMode(LED_BUILTIN, OUTPUT);
-  Serial.println("Device ready!");
-}}
-
-void loop() {{
-  digitalWrite(LED_BUILTIN, ledState);
-  delay(100);
-}}
+            content = "// " + data.name + _ARDUINO_TEMPLATE_SUFFIX
 
-// @remote_function
-void toggleLED() {{
-  ledState = !ledState;
-}}
-'''
-
-        code_file = CodeFile(
-            id=str(uuid.uuid4()),
+        code_file = CodeFile.model_construct(
+            id=self._new_id("file", self.code_files),
             projectId=project.id,
             name=file_name,
             language=language,
-            content=content,
+            content=self._pool_content(content),
         )
-        self.code_files[code_file.id] = code_file
+        self._put_child(self.code_files, self._files_by_project, code_file)
         return project
 
     def update_project(self, id: str, updates: dict) -> Optional[Project]:
         project = self.projects.get(id)
         if not project:
             return None
-        updated_data = project.model_dump()
-        updated_data.update(updates)
-        updated_data["updatedAt"] = datetime.now().isoformat()
-        updated_project = Project(**updated_data)
+        updated_project = _with_updates(project, {**updates, "updatedAt": datetime.now().isoformat()})
         self.projects[id] = updated_project
+        self._bump("projects")
         return updated_project
 
+    def _touch_project(self, id: str):
+        """Mark a project as just modified, e.g. after one of its files changed"""
+        project = self.projects.get(id)
+        if project is not None:
+            self.projects[id] = project.model_copy(update={"updatedAt": datetime.now().isoformat()})
+            self._bump("projects")
+
     def delete_project(self, id: str) -> bool:
         if id not in self.projects:
             return False
-        files_to_delete = [fid for fid, f in self.code_files.items() if f.projectId == id]
+        files_to_delete = self._files_by_project.pop(id, {})
         for fid in files_to_delete:
-            del self.code_files[fid]
-        dashboards_to_delete = [did for did, d in self.dashboards.items() if d.projectId == id]
-        for did in dashboards_to_delete:
-            del self.dashboards[did]
-        links_to_delete = [lid for lid, l in self.device_links.items() if l.projectId == id]
+            self._unpool_content(self.code_files[fid].content)
+        self.code_files = self._remove_keys(self.code_files, files_to_delete)
+        dashboards_to_delete = self._dashboards_by_project.pop(id, {})
+        self.dashboards = self._remove_keys(self.dashboards, dashboards_to_delete)
+        if dashboards_to_delete:
+            self._bump("dashboards")
+        links_to_delete = self._links_by_project.pop(id, {})
         for lid in links_to_delete:
-            del self.device_links[lid]
+            self._unindex_child(self._links_by_device, self.device_links[lid].deviceId, lid)
+        self.device_links = self._remove_keys(self.device_links, links_to_delete)
         del self.projects[id]
+        self._bump("projects")
         return True
 
     # ============== Code Files ==============
     
-    def get_project_files(self, project_id: str) -> List[CodeFile]:
-        return [f for f in self.code_files.values() if f.projectId == project_id]
+    def get_project_files(self, project_id: str) -> Iterable[CodeFile]:
+        return (self.code_files[fid] for fid in self._files_by_project.get(project_id, ()))
 
     def get_code_file(self, id: str) -> Optional[CodeFile]:
         return self.code_files.get(id)
 
     def create_code_file(self, data: InsertCodeFile) -> CodeFile:
-        code_file = CodeFile(
-            id=str(uuid.uuid4()),
+        code_file = CodeFile.model_construct(
+            id=self._new_id("file", self.code_files),
             projectId=data.projectId,
             name=data.name,
-            content=data.content,
+            content=self._pool_content(data.content),
             language=data.language,
         )
-        self.code_files[code_file.id] = code_file
-        if data.projectId in self.projects:
-            self.update_project(data.projectId, {})
+        self._put_child(self.code_files, self._files_by_project, code_file)
+        self._touch_project(data.projectId)
         return code_file
 
     def update_code_file(self, id: str, updates: dict) -> Optional[CodeFile]:
         code_file = self.code_files.get(id)
         if not code_file:
             return None
-        updated_data = code_file.model_dump()
-        updated_data.update(updates)
-        updated_file = CodeFile(**updated_data)
-        self.code_files[id] = updated_file
-        if code_file.projectId in self.projects:
-            self.update_project(code_file.projectId, {})
+        updated_file = _with_updates(code_file, updates)
+        # Pool only once validation has passed, so a rejected update leaves
+        # the refcounts untouched
+        if "content" in updates:
+            content = self._pool_content(updated_file.content)
+            self._unpool_content(code_file.content)
+            if content is not updated_file.content:
+                updated_file = updated_file.model_copy(update={"content": content})
+        self._put_child(self.code_files, self._files_by_project, updated_file, code_file)
+        self._touch_project(code_file.projectId)
         return updated_file
 
     def delete_code_file(self, id: str) -> bool:
-        if id not in self.code_files:
+        code_file = self.code_files.get(id)
+        if not code_file:
             return False
-        del self.code_files[id]
+        self._unpool_content(code_file.content)
+        self._drop_child(self.code_files, self._files_by_project, id)
         return True
 
     # ============== Devices ==============
     
-    def get_devices(self) -> List[Device]:
-        return list(self.devices.values())
+    def get_devices(self) -> Iterable[Device]:
+        return self.devices.values()
 
     def get_device(self, id: str) -> Optional[Device]:
         return self.devices.get(id)
     
+    def device_exists(self, id: str) -> bool:
+        return id in self.devices
+    
     def get_project_devices(self, project_id: str) -> List[Device]:
-        return [d for d in self.devices.values() if d.projectId == project_id]
+        return [self.devices[did] for did in self._devices_by_project.get(project_id, ())]
 
     def create_device(self, data: InsertDevice) -> Device:
-        device = Device(
-            id=str(uuid.uuid4()),
+        device = Device.model_construct(
+            id=self._new_id("dev", self.devices),
             name=data.name,
             hardware=data.hardware,
             ipAddress=data.ipAddress,
             status=data.status,
-            lastSeen=datetime.now().isoformat(),
+            lastSeen=_now_iso(),
             projectId=data.projectId,
             role=data.role or "primary",
             capabilities=data.capabilities or {"gpio": True, "adc": True, "wifi": True, "i2c": True, "spi": True},
             connectionType=data.connectionType,
         )
         self.devices[device.id] = device
+        self._index(self._devices_by_project, device.projectId, device.id)
+        self._bump("devices")
         return device
 
     def update_device(self, id: str, updates: dict) -> Optional[Device]:
         device = self.devices.get(id)
         if not device:
             return None
-        updated_data = device.model_dump()
-        updated_data.update(updates)
-        updated_device = Device(**updated_data)
+        updated_device = _with_updates(device, updates)
         self.devices[id] = updated_device
+        self._reindex(self._devices_by_project, device.projectId, updated_device.projectId, id)
+        self._bump("devices")
         return updated_device
 
     def delete_device(self, id: str) -> bool:
-        if id not in self.devices:
+        device = self.devices.get(id)
+        if not device:
             return False
-        links_to_delete = [lid for lid, l in self.device_links.items() if l.deviceId == id]
+        links_to_delete = self._links_by_device.pop(id, {})
         for lid in links_to_delete:
-            del self.device_links[lid]
-        bindings_to_delete = [bid for bid, b in self.code_bindings.items() if b.deviceId == id]
+            self._unindex_child(self._links_by_project, self.device_links[lid].projectId, lid)
+        self.device_links = self._remove_keys(self.device_links, links_to_delete)
+        bindings_to_delete = self._bindings_by_device.pop(id, {})
         for bid in bindings_to_delete:
-            del self.code_bindings[bid]
+            self._unindex_child(self._bindings_by_file, self.code_bindings[bid].codeFileId, bid)
+        self.code_bindings = self._remove_keys(self.code_bindings, bindings_to_delete)
+        self._unindex_child(self._devices_by_project, device.projectId, id)
         del self.devices[id]
+        self._bump("devices")
         return True
     
     def update_device_sensor_data(self, device_id: str, sensor_data: Dict[str, Any]) -> Optional[Device]:
         device = self.devices.get(device_id)
         if not device:
             return None
-        current_data = device.sensorData or {}
-        current_data.update(sensor_data)
+        # Build a new dict; the stored device (and its cached encoding) must not change under it
         return self.update_device(device_id, {
-            "sensorData": current_data,
-            "lastSeen": datetime.now().isoformat(),
+            "sensorData": {**(device.sensorData or {}), **sensor_data},
+            "lastSeen": _now_iso(),
             "status": "online"
         })
 
     # ============== Device Links ==============
     
     def get_device_links(self, device_id: str = None, project_id: str = None) -> List[DeviceLink]:
-        links = list(self.device_links.values())
-        if device_id:
-            links = [l for l in links if l.deviceId == device_id]
-        if project_id:
-            links = [l for l in links if l.projectId == project_id]
-        return links
+        by_device = self._links_by_device.get(device_id, {}) if device_id else None
+        by_project = self._links_by_project.get(project_id, {}) if project_id else None
+        if by_device is None and by_project is None:
+            return list(self.device_links.values())
+        # Walk the smaller bucket; the other filter is a membership test
+        if by_device is None or (by_project is not None and len(by_project) < len(by_device)):
+            by_device, by_project = by_project, by_device
+        return [self.device_links[lid] for lid in by_device if by_project is None or lid in by_project]
     
     def get_device_link(self, id: str) -> Optional[DeviceLink]:
         return self.device_links.get(id)
     
     def create_device_link(self, data: InsertDeviceLink) -> DeviceLink:
         now = datetime.now().isoformat()
-        link = DeviceLink(
-            id=str(uuid.uuid4()),
+        link = DeviceLink.model_construct(
+            id=self._new_id("link", self.device_links),
             deviceId=data.deviceId,
             projectId=data.projectId,
             dashboardId=data.dashboardId,
@@ -576,6 +862,7 @@ void toggleLED() {{
             lastSync=now,
         )
         self.device_links[link.id] = link
+        self._index_link(link)
         self.update_device(data.deviceId, {"projectId": data.projectId})
         return link
     
@@ -583,11 +870,10 @@ void toggleLED() {{
         link = self.device_links.get(id)
         if not link:
             return None
-        updated_data = link.model_dump()
-        updated_data.update(updates)
-        updated_data["lastSync"] = datetime.now().isoformat()
-        updated_link = DeviceLink(**updated_data)
+        updated_link = _with_updates(link, {**updates, "lastSync": _now_iso()})
         self.device_links[id] = updated_link
+        self._reindex(self._links_by_device, link.deviceId, updated_link.deviceId, id)
+        self._reindex(self._links_by_project, link.projectId, updated_link.projectId, id)
         return updated_link
     
     def delete_device_link(self, id: str) -> bool:
@@ -595,22 +881,25 @@ void toggleLED() {{
         if not link:
             return False
         self.update_device(link.deviceId, {"projectId": None})
+        self._unindex_child(self._links_by_device, link.deviceId, id)
+        self._unindex_child(self._links_by_project, link.projectId, id)
         del self.device_links[id]
         return True
 
     # ============== Code Bindings ==============
     
     def get_code_bindings(self, code_file_id: str = None, device_id: str = None) -> List[CodeBinding]:
-        bindings = list(self.code_bindings.values())
-        if code_file_id:
-            bindings = [b for b in bindings if b.codeFileId == code_file_id]
-        if device_id:
-            bindings = [b for b in bindings if b.deviceId == device_id]
-        return bindings
+        by_file = self._bindings_by_file.get(code_file_id, {}) if code_file_id else None
+        by_device = self._bindings_by_device.get(device_id, {}) if device_id else None
+        if by_file is None and by_device is None:
+            return list(self.code_bindings.values())
+        if by_file is None or (by_device is not None and len(by_device) < len(by_file)):
+            by_file, by_device = by_device, by_file
+        return [self.code_bindings[bid] for bid in by_file if by_device is None or bid in by_device]
     
     def create_code_binding(self, data: InsertCodeBinding) -> CodeBinding:
-        binding = CodeBinding(
-            id=str(uuid.uuid4()),
+        binding = CodeBinding.model_construct(
+            id=self._new_id("bind", self.code_bindings),
             codeFileId=data.codeFileId,
             deviceId=data.deviceId,
             variableName=data.variableName,
@@ -620,71 +909,86 @@ void toggleLED() {{
             widgetId=data.widgetId,
         )
         self.code_bindings[binding.id] = binding
+        self._index_binding(binding)
         return binding
     
     def delete_code_binding(self, id: str) -> bool:
-        if id not in self.code_bindings:
+        binding = self.code_bindings.pop(id, None)
+        if not binding:
             return False
-        del self.code_bindings[id]
+        self._unindex_child(self._bindings_by_file, binding.codeFileId, id)
+        self._unindex_child(self._bindings_by_device, binding.deviceId, id)
         return True
 
     # ============== Sensor History ==============
     
-    def add_sensor_reading(self, device_id: str, sensor_name: str, value: Any, unit: str = None):
-        if device_id not in self.sensor_history:
-            self.sensor_history[device_id] = []
-        reading = DeviceSensorReading(
-            deviceId=device_id,
-            sensorName=sensor_name,
-            value=value,
-            unit=unit,
-            timestamp=datetime.now().isoformat()
+    def add_sensor_readings(self, device_id: str, readings: Dict[str, Any]):
+        """Record several sensors from one update with a shared timestamp"""
+        history = self.sensor_history[device_id]
+        timestamp = datetime.now().isoformat()
+        # Keys of a decoded JSON object are always str; nothing left to validate
+        history.extend(
+            DeviceSensorReading.model_construct(
+                deviceId=device_id,
+                sensorName=sensor_name,
+                value=value,
+                unit=None,
+                timestamp=timestamp
+            )
+            for sensor_name, value in readings.items()
         )
-        self.sensor_history[device_id].append(reading)
-        if len(self.sensor_history[device_id]) > 1000:
-            self.sensor_history[device_id] = self.sensor_history[device_id][-1000:]
     
     def get_sensor_history(self, device_id: str, sensor_name: str = None, limit: int = 100) -> List[DeviceSensorReading]:
-        readings = self.sensor_history.get(device_id, [])
+        readings = self.sensor_history.get(device_id, ())
         if sensor_name:
-            readings = [r for r in readings if r.sensorName == sensor_name]
-        return readings[-limit:]
+            return [r for r in readings if r.sensorName == sensor_name][-limit:]
+        if limit <= 0:
+            return list(readings)[-limit:]
+        # Walk back from the newest end so only `limit` readings are touched
+        latest = list(itertools.islice(reversed(readings), limit))
+        latest.reverse()
+        return latest
 
     # ============== Dashboards ==============
     
-    def get_project_dashboards(self, project_id: str) -> List[Dashboard]:
-        return [d for d in self.dashboards.values() if d.projectId == project_id]
+    def get_project_dashboards(self, project_id: str) -> Iterable[Dashboard]:
+        return (self.dashboards[did] for did in self._dashboards_by_project.get(project_id, ()))
 
     def get_dashboard(self, id: str) -> Optional[Dashboard]:
         return self.dashboards.get(id)
 
     def create_dashboard(self, data: InsertDashboard) -> Dashboard:
-        dashboard = Dashboard(
-            id=str(uuid.uuid4()),
+        dashboard = Dashboard.model_construct(
+            id=self._new_id("dash", self.dashboards),
             projectId=data.projectId,
             name=data.name,
             widgets=data.widgets,
             layout=data.layout,
         )
-        self.dashboards[dashboard.id] = dashboard
+        self._put_child(self.dashboards, self._dashboards_by_project, dashboard)
+        self._bump("dashboards")
         return dashboard
 
     def update_dashboard(self, id: str, updates: dict) -> Optional[Dashboard]:
         dashboard = self.dashboards.get(id)
         if not dashboard:
             return None
-        updated_data = dashboard.model_dump()
-        updated_data.update(updates)
-        updated_dashboard = Dashboard(**updated_data)
-        self.dashboards[id] = updated_dashboard
+        updated_dashboard = _with_updates(dashboard, updates)
+        self._put_child(self.dashboards, self._dashboards_by_project, updated_dashboard, dashboard)
+        self._bump("dashboards")
         return updated_dashboard
 
     def delete_dashboard(self, id: str) -> bool:
         if id not in self.dashboards:
             return False
-        del self.dashboards[id]
+        self._drop_child(self.dashboards, self._dashboards_by_project, id)
+        self._bump("dashboards")
         return True
 
 
-# Global storage instance
-storage = MemStorage()
+# Saved on shutdown and restored on start when set
+SNAPSHOT_PATH = os.getenv("MICROCODELAB_SNAPSHOT")
+
+# Global storage instance; sample data only when MICROCODELAB_SEED=1 and
+# there is no snapshot to restore
+storage = MemStorage(seed=os.getenv("MICROCODELAB_SEED") == "1", snapshot=SNAPSHOT_PATH)